@@ -0,0 +1,30 @@
+'''Per-step cost of the do_variation loop for the NumPy and numba backends.
+
+Run from the top of the source tree with "PYTHONPATH=. python benchmarks/bench_variation.py". The numba backend is compiled once before timing, so the numbers are the steady-state cost of one variation step.'''
+import time
+import numpy as np
+
+from pydinger import pydinger
+
+
+def time_steps(N, backend, nsteps):
+    '''Returns the average wall-clock time of one variation step, in microseconds.'''
+    grid = pydinger.Grid(np.linspace(-1, 1, 200), True)
+    grid.set_N(N)
+    grid.set_v(2.0)
+    grid.coefficients = np.ones(N)
+    start = time.time()
+    result = grid.do_variation(nsteps, backend = backend)
+    return((time.time() - start) / result.nsteps * 1e6)
+
+
+if __name__ == '__main__':
+    if(pydinger.numba is None):
+        print("numba is not installed, only timing the NumPy backend")
+        backends = ['numpy']
+    else:
+        backends = ['numpy', 'numba']
+        time_steps(5, 'numba', 1)#compile the kernel before timing
+    for N in [10, 50, 200]:
+        for backend in backends:
+            print("N = {:4d}  {:6s} {:10.2f} us/step".format(N, backend, time_steps(N, backend, 2000)))
@@ -0,0 +1,175 @@
+'''This picks the basis, basis size, grid density and solver for a job, instead of guessing them.
+
+autotune runs cheap pilot solves of the job at a ladder of resolutions for each basis: a few basis sizes N for the spectral bases, and a few axis strides (every point, every 2nd point, ...) for finite differences, where the grid density is the basis size. The pilots get the exact lowest energy with a direct eigensolve, since the Rayleigh quotient we minimize only sees the symmetric part of the operator. From the last few energies of each ladder it estimates the rate at which the energy converges, extrapolates to the limit, and so estimates the error of each rung. On each ladder the first rung whose estimated error is within tol is the cheapest that will do, and the fastest of those (by pilot time, the best of a few solves, not counting building the grid) wins; a ladder that isn't converging is never picked. The bases don't all describe the same problem (Fourier is periodic, Chebyshev has hard walls, Legendre has no boundary conditions at all), so by default only the job's own basis is tuned, and when several are asked for, a ladder only competes if its limit agrees within tol with the limit for the job's basis. Then the solvers that can run that configuration are timed on it, and the fastest one that gets within tol of the pilot energy is picked, along with a do_variation cutoff if that is the one.
+
+Decisions are saved in a JSON cache keyed by a hash of the job, the contents of its axis and the tuning settings, so tuning the same input again is just a lookup.'''
+import hashlib
+import json
+import os
+import sys
+import time
+import numpy as np
+
+from .pydinger import make_grid, parse_jobs, load_axis, numba, scipy
+
+
+def stride_axis(axis, stride):
+    '''This keeps every stride-th point of the axis, always including the last one so the span doesn't change.'''
+    strided = axis[::stride]
+    if((len(axis) - 1) % stride != 0):
+        strided = np.append(strided, axis[-1])
+    strided = np.array(strided)
+    strided.flags.writeable = False
+    return(strided)
+
+def make_tuned_grid(job, decision, axes = None):
+    '''This builds the Grid for a job with the settings from an autotune decision applied.'''
+    if(axes is None):
+        axes = {}
+    tuned = dict(job, BASIS = decision['BASIS'], SIZE = decision['SIZE'])
+    axis = stride_axis(load_axis(job['TARGET'], axes), decision['STRIDE'])
+    return(make_grid(tuned, {job['TARGET']: axis}))
+
+def pilot_energy(grid):
+    '''This returns the lowest energy the grid's basis can reach, straight from an eigensolve. Finite differences never go dense: the sparse eigensolver if scipy is installed, the banded block iteration if not.'''
+    if(grid.basis == 2):
+        if(scipy is not None):
+            return(float(grid.get_lowest_states_sparse(1)[0][0]))
+        return(float(grid.get_lowest_states(1)[0][0]))
+    operator = grid.get_operator()
+    return(float(np.linalg.eigvalsh(0.5 * (operator + operator.T).real)[0]))
+
+def estimate_limit(energies):
+    '''This extrapolates a ladder of energies of increasing resolution to its limit. If the last differences shrink by a steady ratio q (geometric convergence, or algebraic convergence on a ladder that doubles the resolution each rung), the limit is E_last + d q/(1 - q). Returns None for a ladder that doesn't converge like that.'''
+    energies = np.asarray(energies, dtype = np.float64)
+    differences = np.diff(energies)
+    scale = max(np.abs(energies).max(), 1e-300)
+    if(len(differences) == 0):
+        return(None)
+    if(np.abs(differences[-1]) <= 1e-12 * scale):
+        return(float(energies[-1]))#converged already, to rounding
+    if(len(differences) < 2 or differences[-2] == 0):
+        return(None)
+    q = differences[-1]/differences[-2]
+    if(not 0 < q < 0.9):#oscillating, stalling or diverging: don't trust an extrapolation
+        return(None)
+    return(float(energies[-1] + differences[-1] * q/(1 - q)))
+
+def estimate_errors(energies):
+    '''This estimates the error of each energy in a ladder from its distance to estimate_limit. A ladder that isn't converging gets infinite errors.'''
+    limit = estimate_limit(energies)
+    if(limit is None):
+        return(np.full(len(energies), np.inf))
+    return(np.abs(np.asarray(energies, dtype = np.float64) - limit))
+
+def get_cache_key(job, axis, tol, sizes, strides, bases, cutoff):
+    '''This hashes everything a tuning decision depends on, including which of the optional solvers are installed.'''
+    text = json.dumps([sorted(job.items()), hashlib.sha1(np.ascontiguousarray(axis, dtype = np.float64).tobytes()).hexdigest(), tol, list(sizes), list(strides), list(bases), cutoff, numba is not None, scipy is not None])
+    return(hashlib.sha1(text.encode('utf-8')).hexdigest())
+
+def make_grid_copy(grid):
+    '''This copies a grid's settings onto a fresh Grid with no coefficients, so each solver starts from the same place.'''
+    trial = type(grid)(grid.axis)
+    for name in ('c', 'v', 'N', 'basis', 'fourier', 'fd_order', 'real_fourier'):
+        setattr(trial, name, getattr(grid, name))
+    trial.coefficients = np.ones(trial.N, dtype = trial.dtype)
+    return(trial)
+
+def time_pilot(grid, repeats = 3):
+    '''This returns the lowest energy for the grid and the best time of a few pilot solves, which is much less noisy than a single one.'''
+    best = np.inf
+    for i in range(repeats):
+        start = time.time()
+        energy = pilot_energy(grid)
+        best = min(best, time.time() - start)
+    return(energy, best)
+
+def time_solvers(grid, tol, energy, cutoff):
+    '''This times each solver that can run on the grid, and returns the name of the fastest that lands within tol of the pilot energy (or 'eigen' if none does), with the do_variation cutoff to use. The numba kernel is left out for finite differences, where do_variation would fall back to NumPy anyway.'''
+    solvers = ['eigen', 'variation']
+    if(grid.basis == 2 and scipy is not None):
+        solvers.append('sparse')
+    if(numba is not None and grid.basis != 2):
+        solvers.append('numba')
+    best = ('eigen', np.inf, None)
+    for solver in solvers:
+        trial = make_grid_copy(grid)
+        if(solver == 'numba'):
+            make_grid_copy(grid).do_variation(1, adaptive = True, backend = 'numba')#don't time the compile
+        start = time.time()
+        steps = None
+        if(solver == 'eigen'):
+            found = trial.get_lowest_states(1)[0][0]
+        elif(solver == 'sparse'):
+            found = trial.get_lowest_states_sparse(1)[0][0]
+        else:
+            result = trial.do_variation(cutoff, rtol = 1e-14, adaptive = True, backend = 'numba' if solver == 'numba' else 'numpy')
+            found = result.energy
+            steps = result.nsteps
+        elapsed = time.time() - start
+        if(abs(found - energy) <= tol and elapsed < best[1]):
+            best = (solver, elapsed, steps)
+    return(best[0], None if best[2] is None else max(2*best[2], 100))
+
+def autotune(job, tol = 1e-6, sizes = (8, 16, 32, 64), strides = (8, 4, 2, 1), bases = None, cache = 'autotune_cache.json', cutoff = 20000, axes = None):
+    '''This picks the cheapest (basis, N, grid density, solver) for a parsed job that gets the energy within tol, as described at the top of this module. By default only the job's own BASIS is tuned (make_grid's default, Fourier, if it has none); other bases in bases only compete if their ladder's limit agrees with that basis's within tol. Returns a decision dict with BASIS, SIZE, STRIDE, solver, cutoff, the pilot energy, its estimated error, and met, which is False if nothing reached tol and the most accurate pilot of the job's basis was picked instead. With cache set to None nothing is saved.'''
+    if(axes is None):
+        axes = {}
+    reference = job.get('BASIS', 1)#make_grid's default
+    if(bases is None):
+        bases = [reference]
+    elif(reference not in bases):
+        reference = bases[0]
+    axis = load_axis(job['TARGET'], axes)
+    key = get_cache_key(job, axis, tol, sizes, strides, bases, cutoff)
+    decisions = {}
+    if(cache is not None and os.path.exists(cache)):
+        with open(cache) as f:
+            decisions = json.load(f)
+        if(key in decisions):
+            return(decisions[key])
+    pilots = []#(cost, error, basis, size, stride, energy)
+    good = {}#basis -> the first rung within tol on its ladder: further up only costs more
+    limits = {}
+    for basis in bases:
+        ladder = [(len(stride_axis(axis, stride)), stride) for stride in strides] if basis == 2 else [(size, 1) for size in sizes]
+        energies = []
+        costs = []
+        for size, stride in ladder:
+            energy, cost = time_pilot(make_tuned_grid(job, {'BASIS': basis, 'SIZE': size, 'STRIDE': stride}, axes))
+            energies.append(energy)
+            costs.append(cost)
+        errors = estimate_errors(energies)
+        limits[basis] = estimate_limit(energies)
+        for (size, stride), energy, cost, error in zip(ladder, energies, costs, errors):
+            pilots.append((cost, error, basis, size, stride, energy))
+        within = [pilot for pilot in pilots[-len(ladder):] if pilot[1] <= tol]
+        if(within):
+            good[basis] = within[0]
+    #a different Hamiltonian can't stand in for the job's own, so the other ladders have to end up at the same energy
+    good = [pilot for basis, pilot in good.items() if limits[reference] is not None and abs(limits[basis] - limits[reference]) <= tol]
+    met = len(good) > 0
+    if(met):
+        cost, error, basis, size, stride, energy = min(good)
+    else:
+        #the most accurate rung of the job's own ladder; when nothing converges every error is inf, and the finest rung is the best bet
+        ladder = [pilot for pilot in pilots if pilot[2] == reference]#coarsest first
+        cost, error, basis, size, stride, energy = min(reversed(ladder), key = lambda pilot: pilot[1])
+    decision = {'BASIS': basis, 'SIZE': size, 'STRIDE': stride, 'energy': energy, 'error': float(error), 'met': met}
+    grid = make_tuned_grid(job, decision, axes)
+    decision['solver'], decision['cutoff'] = time_solvers(grid, tol, energy, cutoff)
+    if(cache is not None):
+        decisions[key] = decision
+        with open(cache + '.tmp', 'w') as f:
+            json.dump(decisions, f, indent = 1)
+        os.replace(cache + '.tmp', cache)
+    return(decision)
+
+
+if __name__ == '__main__':
+    if(len(sys.argv) < 2):
+        print("usage: python -m pydinger.autotune JOBFILE [TOL]")
+    else:
+        tol = float(sys.argv[2]) if len(sys.argv) > 2 else 1e-6
+        for i, job in enumerate(parse_jobs(sys.argv[1])):
+            print("{} {}".format(i, autotune(job, tol)))
@@ -1,6 +1,10 @@
 from pydinger import *
+from results import ResultsWriter
 
-grid = read_input('./input.txt')
-grid.do_variation(10000)
-print("The final coefficients were: {}".format(grid.coefficients))
-print("And that makes the ground state energy: {}".format(grid.get_energy()))
+with ResultsWriter('./results') as writer:
+    for i, grid in enumerate(read_jobs('./input.txt')):
+        result = grid.do_variation(10000, rtol = 1e-12, callback = writer.trajectory(i))
+        writer.add(i, result, grid.coefficients)
+        print("Stopped after {} steps ({})".format(result.nsteps, result.reason))
+        print("The final coefficients were: {}".format(grid.coefficients))
+        print("And that makes the ground state energy: {}".format(grid.get_energy()))
@@ -1,56 +1,179 @@
+import json
+import math
+import time
 import numpy as np
 import numpy.polynomial.legendre as L
+import numpy.polynomial.chebyshev as C
+try:
+    import numba#optional, for the compiled variation backend
+except ImportError:
+    numba = None
+try:
+    import tomllib#python 3.11+, for TOML job files
+except ImportError:
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+try:
+    import scipy.sparse
+    import scipy.sparse.linalg
+except ImportError:
+    scipy = None#optional, for sparse storage and eigensolvers of the finite-difference basis
+
+STOP_REASONS = ('cutoff', 'stationary', 'energy', 'gradient', 'rtol')#indexed by the codes variation_kernel returns
+TRANSFORM_PLANS = {}#(direction, n) -> Toeplitz symbol and Hankel factors, see get_transform_plan
+SHEN_FACTORS = {}#n -> banded Cholesky factor of the hard-wall mass matrix, see shen_mass_factor
+KEYWORDS = {'TARGET': str, 'CONSTANT': float, 'BASIS': int, 'ORDER': int, 'SIZE': int, 'POTENTIAL': float, 'FUNCTION': str}#input keywords and their types
 
 class Grid:
     '''This class is a grid implementation for holding our input data'''
-    def __init__(self, axis, fourier = True):
+    def __init__(self, axis, fourier = True, dtype = np.float64):
+        self.dtype = np.dtype(dtype)#storage precision for axis, wavefunction and coefficients
         self.coefficients = []#holds our basis set coefficients later
-        self.axis = np.array(axis)
+        self.axis = np.asarray(axis, dtype = self.dtype)
         self.v = 0.0
         self.c = 1.0#this is the constant used in the Hamiltonian
         self.fourier = fourier#use Fourier series by default
+        self.basis = int(fourier)#0 Legendre, 1 Fourier, 2 finite differences, 3 Chebyshev
+        self.fd_order = 2#accuracy order of the finite-difference stencils
+        self.fd_bands = None#banded second-derivative weights, built on demand
+        self.real_fourier = False#store Fourier coefficients as packed real cos/sin values instead of complex
         self.N = 50#a fairly accurate number
-        self.period = abs(self.axis[0] - self.axis[len(self.axis)-1])#treat as if it's periodic
+        self.period = float(abs(self.axis[0] - self.axis[len(self.axis)-1]))#treat as if it's periodic
         self.hmat = []
         self.wavefunc = []
-        self.changes = [0 for i in range(len(axis))]#start with all changes being 0
+        self.changes = np.zeros(len(self.axis), dtype = int)#start with all changes being 0
+        self.active = None#indices of the modes do_active_variation ended up using
+        self.operator = None#cached dense Hamiltonian for the spectral bases, see get_operator
+        self.operator_key = None#the settings self.operator was built for
 
     def set_c(self, new_c):
         '''For setting the new constant in the operator.'''
         self.c = new_c
+        self.operator = None
         
     def set_N(self, new_N):
         '''For setting how big our basis set will be.'''
         self.N = new_N
+        self.operator = None
 
     def set_v(self, new_v):
         '''For setting our potential.'''
         self.v = new_v
+        self.operator = None
         
-    def set_basis(self, new_bool):
-        '''For choosing which basis set to use.'''
-        self.fourier = new_bool
+    def set_basis(self, new_basis):
+        '''For choosing which basis set to use: 1 (or True) for Fourier, 0 (or False) for Legendre, 2 for finite differences on the points of the axis itself, and 3 for Chebyshev polynomials that vanish at both ends of the axis.'''
+        self.basis = int(new_basis)
+        self.fourier = (self.basis == 1)
+        self.operator = None
+        if(self.basis == 2):
+            self.N = len(self.axis)#one value per grid point
+
+    def set_fd_order(self, new_order):
+        '''For choosing the accuracy order (2, 4 or 6) of the finite-difference stencils.'''
+        if(new_order not in (2, 4, 6)):
+            raise ValueError("Finite-difference order must be 2, 4 or 6, not {}".format(new_order))
+        self.fd_order = new_order
+        self.fd_bands = None
+        self.operator = None
+
+    def set_dtype(self, new_dtype):
+        '''For choosing the storage precision. np.float32 halves the memory of the axis, wavefunction and coefficients. Coefficients keep their kind: real ones become float32, and only complex ones (the complex Fourier series of a FUNCTION) become complex64. Energies are still accumulated in float64, so they agree with float64 storage to about 1e-6 relative.'''
+        self.dtype = np.dtype(new_dtype)
+        self.axis = self.axis.astype(self.dtype)
+        if(len(self.wavefunc) > 0):
+            self.wavefunc = np.asarray(self.wavefunc).astype(self.dtype)
+        if(len(self.coefficients) > 0):
+            coefficients = np.asarray(self.coefficients)
+            if(np.iscomplexobj(coefficients)):
+                self.coefficients = coefficients.astype(np.result_type(self.dtype, np.complex64))
+            else:
+                self.coefficients = coefficients.astype(self.dtype)
+
+    def set_real_fourier(self, new_bool):
+        '''For choosing the packed real sine/cosine form of the Fourier series, (A0, A1, B1, A2, B2, ...), which stores N real numbers instead of N complex ones.'''
+        self.real_fourier = new_bool
+        self.operator = None
+
+    def get_coefficient_dtype(self):
+        '''Returns the dtype our coefficients are stored in: complex for the regular Fourier series, real for everything else.'''
+        if(self.fourier == True and not self.real_fourier):
+            return(np.result_type(self.dtype, np.complex64))
+        return(self.dtype)
+
+    def get_working_coefficients(self):
+        '''Returns the coefficients promoted to double precision, for precision-sensitive arithmetic on compact storage.'''
+        coefficients = np.asarray(self.coefficients)
+        return(coefficients.astype(np.result_type(coefficients, np.float64), copy = False))
 
     def set_wavefunc(self, func):
-        '''Takes in a function of x as a python-formatted string. For example, "2*x + np.cos(x*np.pi)" would work. Evaluates the function on the axis of the grid and stores it as a numpy array.'''
-        for x in self.axis:
-            self.wavefunc.append(eval(func))
-        self.wavefunc = np.array(self.wavefunc)
+        '''Takes in a function of x as a python-formatted string. For example, "2*x + np.cos(x*np.pi)" would work. Evaluates the function on the axis of the grid and stores it as a numpy array. The whole axis goes through in one go when the expression works on arrays, otherwise point by point.'''
+        try:
+            values = np.asarray(eval(func, globals(), {'x': self.axis}))
+        except Exception:
+            values = None
+        if(values is None or values.shape != self.axis.shape):
+            values = []
+            for x in self.axis:
+                values.append(eval(func))
+        self.wavefunc = np.array(values, dtype = self.dtype)
 
     def get_coefficients(self, func):
         '''This will dispatch to the appropriate coefficients getter function based on which basis set we're using.'''
-        if(self.fourier == True):
+        if(self.basis == 2):
+            self.get_fd_coefficients( func )
+        elif(self.basis == 3):
+            self.get_chebyshev_coefficients( func )
+        elif(self.fourier == True):
             self.get_fourier_coefficients( func )
         elif(self.fourier == False):
             self.get_legendre_coefficients( func )
 
     def get_legendre_coefficients(self, func):
         '''This returns the actual Legendre-polynomial coefficient values for our function, up to N.'''
-        self.coefficients = L.legfit(self.axis, func, self.N -1)
+        self.coefficients = L.legfit(self.axis, func, self.N -1).astype(self.dtype)
+
+    def get_fd_coefficients(self, func):
+        '''In the finite-difference basis the coefficients are the values of the function at each point of the axis, times the square root of that point's (relative) cell width. On an evenly spaced axis that factor is 1, and on an uneven one it makes the plain dot product c.c a proper integral of |psi|^2.'''
+        self.N = len(self.axis)
+        self.coefficients = (np.asarray(func, dtype = np.float64) * np.sqrt(fd_cell_widths(self.axis))).astype(self.dtype)
+
+    def get_chebyshev_nodes(self, n = None):
+        '''This returns the n (default N) Chebyshev-Gauss-Lobatto points cos(pi j/(n-1)), mapped from [-1, 1] onto the span of the axis.'''
+        if(n is None):
+            n = self.N
+        a, b = float(self.axis.min()), float(self.axis.max())
+        t = np.cos(np.pi * np.arange(n) / max(n - 1, 1))
+        return(0.5*(a + b) + 0.5*(b - a)*t)
+
+    def get_chebyshev_coefficients(self, func):
+        '''This interpolates the function at N+2 Chebyshev-Gauss-Lobatto points, turns that into a Chebyshev series with a DCT done as one real FFT, converts that to a Legendre series (chebyshev_to_legendre), and projects it onto our N orthonormal functions that vanish at the ends of the axis (see shen_mass_factor) with one banded solve, so it is O(N log N) all the way. A polynomial of degree up to N+1 that vanishes at both ends comes back exactly. func can be a function of x, which gives spectral accuracy, or an array of values on the axis, which gets linearly interpolated onto the points first.'''
+        nodes = self.get_chebyshev_nodes(self.N + 2)
+        if(callable(func)):
+            values = np.asarray(func(nodes), dtype = np.float64)
+        else:
+            values = np.interp(nodes, self.axis.astype(np.float64), np.asarray(func, dtype = np.float64))
+        legendre = chebyshev_to_legendre(chebyshev_dct(values))
+        k = np.arange(self.N)
+        projections = 2*legendre[2:]/(2*k + 5) - 2*legendre[:self.N]/(2*k + 1)#the integrals of each L_(k+2) - L_k times the series, on [-1, 1]
+        half = 0.5*(float(self.axis.max()) - float(self.axis.min()))
+        self.coefficients = (np.sqrt(half) * shen_solve(projections)).astype(self.dtype)
+
+    def get_chebyshev_series(self):
+        '''This returns the plain Chebyshev series (N+2 coefficients of T_0 to T_(N+1), in t mapped from the axis onto [-1, 1]) that our orthonormal coefficients stand for.'''
+        half = 0.5*(float(self.axis.max()) - float(self.axis.min()))
+        weights = shen_solve(self.get_working_coefficients(), transpose = True) / np.sqrt(half)#coefficients of each L_(k+2) - L_k
+        legendre = np.zeros(self.N + 2)
+        legendre[2:] += weights
+        legendre[:self.N] -= weights
+        return(legendre_to_chebyshev(legendre))
 
     def cn(self, func, n):
         '''This calculates the nth Fourier coefficient, using a function represented by a numpy array called 'func'. This is a Riemann sum approximation of the integral we would use for the inner product.'''
-        c = func * np.exp(-1j*2*n*np.pi*self.axis/self.period)
+        x = self.axis.astype(np.float64)#always integrate in double precision
+        c = np.asarray(func, dtype = np.float64) * np.exp(-1j*2*n*np.pi*x/self.period)
         return(c.sum()/c.size)
     
     def f(self, func, x):
@@ -59,22 +182,66 @@ class Grid:
         coeff_vals = np.array([2*self.cn(func, i)*np.exp(1j*2*i*np.pi*x/self.period) for i in bounds])
         return(coeff_vals.sum())
     
+    def get_mode_numbers(self):
+        '''Returns the Fourier mode number n of each coefficient. In the complex series coefficient i is mode i; in the packed real series (A0, A1, B1, A2, B2, ...) coefficient i is mode (i+1)//2.'''
+        if(self.real_fourier):
+            return((np.arange(self.N) + 1)//2)
+        return(np.arange(self.N))
+
     def get_fourier_coefficients(self, func):
         '''This fills an array with the N Fourier coefficient values. Only in 1D for now.'''
+        if(self.real_fourier):
+            self.get_real_fourier_coefficients(func)
+            return
+        coefficients = []
         for i in range(self.N):
-            self.coefficients.append(self.cn(func, i))
-        self.coefficients = np.array(self.coefficients)
+            coefficients.append(self.cn(func, i))
+        self.coefficients = np.array(coefficients, dtype = self.get_coefficient_dtype())
+
+    def get_real_fourier_coefficients(self, func):
+        '''This fills an array with the N packed real Fourier coefficients (A0, A1, B1, A2, B2, ...), where A_n = Re(c_n) and B_n = -Im(c_n), so a real wavefunction needs no complex storage. The wavefunction is A0 + 2 sum (A_n cos + B_n sin), i.e. the usual a_n and b_n are 2A_n and 2B_n; storing the halves keeps A_n^2 + B_n^2 = |c_n|^2, so c.c and c.Hc, and with them the energy, are the same as for the complex series with the same modes.'''
+        coefficients = np.zeros(self.N)
+        for i in range(self.N):
+            n = (i + 1)//2
+            c = self.cn(func, n)
+            if(i == 0):
+                coefficients[i] = c.real
+            elif(i % 2 == 1):
+                coefficients[i] = c.real
+            else:
+                coefficients[i] = -c.imag
+        self.coefficients = coefficients.astype(self.dtype)
 
     def get_values(self, func):
         '''This dispatches to the correct get_values function based on which basis we choose.'''
-        if(self.fourier == True):
+        if(self.basis == 2):
+            return(self.get_working_coefficients() / np.sqrt(fd_cell_widths(self.axis)))
+        elif(self.basis == 3):
+            return(self.get_chebyshev_values())
+        elif(self.fourier == True):
             return(self.get_fourier_values( func ))
         elif(self.fourier == False):
             return(self.get_legendre_values())
             
     def get_fourier_values(self, func):
-        '''This will return a numpy array of values at each point on an axis corresponding to our Fourier coefficients found with get_fourier_coefficients().'''
-        values = np.array([self.f(func, x).real for x in self.axis])
+        '''This will return a numpy array of values at each point on an axis corresponding to our Fourier coefficients, the current ones rather than ones recomputed from func (which is only kept for the call signature). It evaluates exactly the series a Solution does, so get_values and get_solution always agree.'''
+        if(self.real_fourier):
+            return(self.get_real_fourier_values())
+        return(self.get_solution()(self.axis))
+
+    def get_real_fourier_values(self):
+        '''This returns a numpy array of values at each point on the axis from the packed real Fourier coefficients, summing A0 + 2(A_n cos + B_n sin).'''
+        x = self.axis.astype(np.float64)
+        coefficients = self.get_working_coefficients()
+        modes = self.get_mode_numbers()
+        values = np.zeros(len(x))
+        for i in range(self.N):
+            theta = 2*modes[i]*np.pi*x/self.period
+            weight = 1.0 if i == 0 else 2.0
+            if(i % 2 == 1 or i == 0):
+                values += weight*coefficients[i]*np.cos(theta)
+            else:
+                values += weight*coefficients[i]*np.sin(theta)
         return(values)
 
     def get_legendre_values(self):
@@ -82,97 +249,1026 @@ class Grid:
         values = np.array(L.legval(self.axis, self.coefficients))
         return(values)
 
+    def get_chebyshev_values(self):
+        '''This returns a numpy array of values at each point on the axis from our Chebyshev coefficients, using the Clenshaw recurrence in chebval on the equivalent plain series.'''
+        a, b = float(self.axis.min()), float(self.axis.max())
+        t = (2*self.axis.astype(np.float64) - (a + b))/(b - a)
+        return(C.chebval(t, self.get_chebyshev_series()))
+
+    def get_solution(self):
+        '''This packs the current coefficients into a Solution, which can be evaluated at any x without the grid. For the finite-difference basis it keeps the values and the axis instead.'''
+        lower, upper = float(self.axis.min()), float(self.axis.max())
+        if(self.basis == 2):
+            return(Solution(self.get_values(None), 2, lower, upper, self.period, axis = self.axis.astype(np.float64)))
+        if(self.basis == 3):
+            return(Solution(self.get_chebyshev_series(), 3, lower, upper, self.period))
+        basis = int(self.fourier == True)
+        return(Solution(self.get_working_coefficients().copy(), basis, lower, upper, self.period, self.real_fourier))
+
     def get_hmat(self):
         '''This dispatches the appropriate hamiltonian for the basis set.'''
-        if(self.fourier == True):
+        if(self.basis == 2):
+            self.get_hmat_fd()
+        elif(self.fourier == True):
             self.get_hmat_fourier()
 
     def get_hmat_fourier(self):
         '''This constructs the Hamiltonian matrix for the Fourier basis set. Conveniently diagonal due to the nature of the Fourier series. Should only ever be called once per run.'''
-        self.hmat = []
-        for i in range(self.N):
-            self.hmat.append([0 for i in range(self.N)])
-        for i in range(self.N):
-            self.hmat[i][i] = (-4* (i**2) * ((np.pi)**2) / self.period)
-            self.hmat = np.array(self.hmat)
+        modes = self.get_mode_numbers()
+        self.hmat = np.diag(-4* (modes**2) * ((np.pi)**2) / self.period)#sine and cosine of the same mode share an entry
+
+    def get_hmat_fd(self):
+        '''This builds the banded second-derivative weights for the finite-difference basis (see fd_weights), once per axis and order. Row i of the Hamiltonian only touches points i-order/2 to i+order/2. Since our coefficients are values scaled by sqrt(cell width), weight (i, j) gets scaled by sqrt(w_i/w_j), which keeps the operator (nearly) symmetric on uneven axes.'''
+        if(self.fd_bands is None or self.fd_bands.shape != (self.fd_order + 1, len(self.axis))):
+            bands = fd_weights(self.axis, self.fd_order)
+            root_widths = np.sqrt(fd_cell_widths(self.axis))
+            p = self.fd_order//2
+            M = len(self.axis)
+            for k in range(-p, p + 1):
+                rows = np.arange(max(0, -k), min(M, M - k))
+                bands[p + k, rows] *= root_widths[rows] / root_widths[rows + k]
+            self.fd_bands = bands
 
     def apply_H(self):
         '''This applies the Hamiltonian operator, dispatching to the appropriate system.'''
-        if(self.fourier == True):
+        if(self.basis == 2):
+            return(self.apply_H_fd())
+        elif(self.basis == 3):
+            return(self.apply_H_chebyshev())
+        elif(self.fourier == True):
             return(self.apply_H_fourier())
         elif(self.fourier == False):
             return(self.apply_H_legendre())
 
     def apply_H_legendre(self):
         '''This applies the Hamiltonian operator, utilizing a builtin capability of the numpy.polynomial.legendre module to get the second derivatives. Note that we have to "pad" the coefficients array with two zeros after taking the second derivative.'''
+        coefficients = self.get_working_coefficients()
         #taking del^2 has never been easier!
-        new_coefficients = L.legder(self.coefficients, 2)
+        new_coefficients = L.legder(coefficients, 2)
         new_coefficients = list(new_coefficients)
         for i in range(2):
             new_coefficients.append(0)
         new_coefficients = np.array(new_coefficients)#what a pain!
-        return(np.array(new_coefficients*(-self.c) + self.v * self.coefficients * self.period))
+        return(np.array(new_coefficients*(-self.c) + self.v * coefficients * self.period))
         
 
+    def apply_H_chebyshev(self):
+        '''This applies the Hamiltonian in the Chebyshev basis in O(N), with two banded solves and a diagonal scaling (see shen_kinetic) instead of the dense Galerkin matrix.'''
+        coefficients = self.get_working_coefficients()
+        half = 0.5*(float(self.axis.max()) - float(self.axis.min()))
+        return(shen_kinetic(coefficients)*self.c/half**2 + self.v*coefficients)
+
+    def apply_H_fd(self, transpose = False):
+        '''This applies the finite-difference Hamiltonian -c d^2/dx^2 + v in O(M) straight from the bands, with the wavefunction taken to be zero just beyond both ends of the axis. With transpose = True it applies H^T instead, which differs on uneven axes.'''
+        self.get_hmat_fd()
+        coefficients = self.get_working_coefficients()
+        return(band_dot(self.fd_bands, coefficients, transpose)*(-self.c) + self.v*coefficients)
+
     def apply_H_fourier(self):
         '''This applies the Hamiltonian operator to our coefficient list in the Fourier basis.'''
+        coefficients = self.get_working_coefficients()
         #this does the matrix multiplication we need:
-        new_coefficients = np.dot(self.hmat, self.coefficients)
+        new_coefficients = np.dot(self.hmat, coefficients)
         #due to the way I have stored my hamiltonian matrix, I do the V adding here
         #it's the same as applying the 'actual' hamiltonian matrix
-        return(new_coefficients*(-self.c) + self.v*self.coefficients*self.period)
+        return(new_coefficients*(-self.c) + self.v*coefficients*self.period)
 
     def get_energy(self):
-        '''This uses the current basis set coefficients and result of taking the hamiltonian to calculate the energy of the "wavefunction".'''
-        #fill with 1s if we're not fitting a given wavefunction.
-        if len(self.coefficients) == 0:
-            self.coefficients = np.ones(self.N)#assume all 1's as some starting point...
+        '''This uses the current basis set coefficients and result of taking the hamiltonian to calculate the energy of the "wavefunction". The dot products are always accumulated in float64, even when the coefficients are stored as float32, and conjugate the coefficients, so complex (Fourier) coefficients give the real expectation value Re(c*.Hc)/c*.c.'''
+        self.fill_coefficients()
         self.get_hmat()
-        return((np.dot((self.coefficients), self.apply_H()))/np.dot(self.coefficients, self.coefficients))#this is the inner product identity of expectation of the hamiltonian
+        return(rayleigh_quotient(self.get_working_coefficients(), self.apply_H()))#this is the inner product identity of expectation of the hamiltonian
+
+    def fill_coefficients(self):
+        '''This fills the coefficients with 1s if we're not fitting a given wavefunction.'''
+        if len(self.coefficients) == 0:
+            if(self.basis == 2):
+                self.N = len(self.axis)
+            self.coefficients = np.ones(self.N, dtype = self.dtype)#assume all 1's as some starting point...
 
     def get_additions(self):
         '''This checks whether we need to increase each basis set coefficient to promote a decrease in energy. This doesn't actually do the changing of the coefficients, only finds which ones should increase.'''
-        e1 = self.get_energy()
-        for i in range(self.N):
-            diff = 0.05 * self.coefficients[i]
-            self.coefficients[i] += diff
-            e2 = self.get_energy()
-            if(e2 < e1):
-                self.changes[i] = 1#need to increase this one
-            self.coefficients[i] -= diff#put it back for further checking
+        e0, e_plus, e_minus = self.get_probe_energies(0.05 * self.get_working_coefficients())
+        self.changes[:self.N][e_plus < e0] = 1#need to increase these ones
 
     def get_subtractions(self):
         '''This checks whether we need to decrease each basis set coefficient to promote a decrease in energy. Like get_additions, this won't change the coefficients, just update the changes array for when we make the changes at the end of each step.'''
-        e1 = self.get_energy()
-        for i in range(self.N):
-            diff = 0.05 * self.coefficients[i]
-            self.coefficients[i] -= diff
-            e2 = self.get_energy()
-            if(e2 < e1):
-                self.changes[i] = -1#need to decrease this one
-            self.coefficients[i] += diff#put it back for further checking
-
-    def do_variation(self, cutoff = 100000):
+        e0, e_plus, e_minus = self.get_probe_energies(0.05 * self.get_working_coefficients())
+        self.changes[:self.N][e_minus < e0] = -1#need to decrease these ones
+
+    def get_changes(self, steps = None):
+        '''This is get_additions followed by get_subtractions in one go: returns the changes vector (1 to increase, -1 to decrease, 0 to leave alone) for probes of +-steps, 5% of each coefficient by default.'''
+        if(steps is None):
+            steps = 0.05 * self.get_working_coefficients()
+        e0, e_plus, e_minus = self.get_probe_energies(steps)
+        return(np.where(e_minus < e0, -1, np.where(e_plus < e0, 1, 0)))
+
+    def get_operator(self):
+        '''This returns the Hamiltonian as a dense N x N matrix acting on the coefficients, so np.dot(H, coefficients) is the same as apply_H(). For the spectral bases it is built once and cached (read-only) until N, c, v, the basis or the Fourier packing change. For the finite-difference basis it isn't cached, and get_sparse_operator is the one to use on anything but small grids.'''
+        key = (self.basis, self.N, self.c, self.v, self.real_fourier, self.period)
+        if(self.operator is not None and self.operator_key == key):
+            return(self.operator)
+        if(self.basis == 2):
+            self.get_hmat_fd()
+            return(bands_to_dense(self.fd_bands)*(-self.c) + np.eye(self.N)*self.v)
+        operator = self.build_operator()
+        operator.flags.writeable = False
+        self.operator = operator
+        self.operator_key = key
+        return(operator)
+
+    def build_operator(self):
+        '''This builds the dense Hamiltonian for one of the spectral bases, for get_operator to cache.'''
+        if(self.basis == 3):
+            #apply_H_chebyshev column by column, symmetrized against rounding
+            half = 0.5*(float(self.axis.max()) - float(self.axis.min()))
+            kinetic = shen_kinetic(np.eye(self.N))
+            return(0.5*(kinetic + kinetic.T)*self.c/half**2 + np.eye(self.N)*self.v)
+        elif(self.fourier == True):
+            self.get_hmat()
+            return(self.hmat*(-self.c) + np.eye(self.N)*self.v*self.period)
+        elif(self.fourier == False):
+            #legder works column by column, so differentiating the identity gives the matrix of del^2
+            second_derivative = np.zeros((self.N, self.N))
+            second_derivative[:self.N-2] = L.legder(np.eye(self.N), 2)
+            return(second_derivative*(-self.c) + np.eye(self.N)*self.v*self.period)
+
+    def get_operator_diagonal(self, indices):
+        '''This returns the diagonal entries of get_operator() for the given coefficient indices, in closed form (O(N) for Chebyshev, see shen_kinetic_diagonal) without building the operator.'''
+        indices = np.asarray(indices, dtype = int)
+        if(self.basis == 3):
+            half = 0.5*(float(self.axis.max()) - float(self.axis.min()))
+            return(shen_kinetic_diagonal(self.N)[indices]*self.c/half**2 + self.v)
+        elif(self.fourier == True):
+            modes = self.get_mode_numbers()[indices]
+            return(4*(modes**2)*((np.pi)**2)/self.period*self.c + self.v*self.period)#the same entries as get_hmat_fourier
+        return(np.full(len(indices), self.v*self.period))#del^2 only ever lowers the Legendre degree
+
+    def get_operator_block(self, rows, columns):
+        '''This returns get_operator()[rows][:, columns] without building the whole operator where the basis allows. The Fourier operator is diagonal, and the Legendre one has a closed form: P_j'' is the sum of (i + 1/2)(j(j+1) - i(i+1)) P_i over i < j - 1 with j - i even. Chebyshev columns come from applying the operator to those unit vectors, O(N) each.'''
+        rows = np.asarray(rows, dtype = int)[:, None]
+        columns = np.asarray(columns, dtype = int)[None, :]
+        if(self.basis == 3):
+            half = 0.5*(float(self.axis.max()) - float(self.axis.min()))
+            kinetic = shen_kinetic(np.eye(self.N)[:, columns[0]])[rows[:, 0]]
+            return(kinetic*self.c/half**2 + np.where(rows == columns, self.v, 0.0))
+        elif(self.fourier == True):
+            return(np.where(rows == columns, self.get_operator_diagonal(columns[0])[None, :], 0.0))
+        second_derivative = np.where((rows < columns - 1) & ((columns - rows) % 2 == 0), (rows + 0.5)*(columns*(columns + 1) - rows*(rows + 1)), 0.0)
+        return(second_derivative*(-self.c) + np.where(rows == columns, self.v*self.period, 0.0))
+
+    def get_sparse_operator(self):
+        '''This returns the finite-difference Hamiltonian as a scipy.sparse CSR matrix. Needs scipy.'''
+        if(scipy is None):
+            raise ImportError("get_sparse_operator needs scipy")
+        self.get_hmat_fd()
+        p = self.fd_order//2
+        M = len(self.axis)
+        offsets = np.arange(-p, p + 1)
+        #dia_matrix wants each diagonal stored by column, while our bands are stored by row
+        data = np.zeros_like(self.fd_bands)
+        for k in offsets:
+            if(k >= 0):
+                data[p + k, k:] = self.fd_bands[p + k, :M - k]
+            else:
+                data[p + k, :M + k] = self.fd_bands[p + k, -k:]
+        second_derivative = scipy.sparse.dia_matrix((data, offsets), shape = (M, M))
+        return((second_derivative*(-self.c) + scipy.sparse.identity(M)*self.v).tocsr())
+
+    def get_lowest_states_sparse(self, k = 1):
+        '''This finds the k lowest states of the finite-difference Hamiltonian with scipy's sparse eigsh. -c d^2/dx^2 is positive for c > 0, so the spectrum starts just above v, and shift-invert mode around v finds the lowest states in a few iterations of a banded O(M) factorization. Like get_lowest_states, it returns the energies and a (k, M) array of normalized values, and leaves the grid holding the ground state.'''
+        operator = self.get_sparse_operator()
+        operator = (0.5 * (operator + operator.T)).tocsc()
+        energies, states = scipy.sparse.linalg.eigsh(operator, k = k, sigma = self.v, which = 'LM')
+        order = np.argsort(energies)
+        energies = energies[order]
+        states = states[:, order]
+        self.N = len(self.axis)
+        self.coefficients = states[:, 0].astype(self.dtype)
+        return(energies, states.T.copy())
+
+    def get_probe_energies(self, steps, hc = None):
+        '''This finds the energy with each coefficient i alone moved by +steps[i], and by -steps[i]. Returns the unmoved energy and the two arrays of probed energies. Nothing is actually moved: all 2N energies come from one closed-form expression (see probe_energies). Pass hc, the result of apply_H() on the current coefficients, if you have it already.'''
+        self.fill_coefficients()
+        coefficients = self.get_working_coefficients()
+        if(hc is None):
+            self.get_hmat()
+            hc = self.apply_H()
+        if(self.basis == 2):
+            #stay O(M) with the banded operator
+            self.get_hmat_fd()
+            diagonal = self.fd_bands[self.fd_order//2]*(-self.c) + self.v
+            return(probe_energies(coefficients, hc, self.apply_H_fd(transpose = True), diagonal, steps))
+        operator = self.get_operator()
+        return(probe_energies(coefficients, hc, np.dot(operator.T, coefficients), np.diag(operator), steps))
+
+    def get_phases(self):
+        '''Returns c_i/|c_i| for every coefficient (1 where it is zero), the direction the adaptive loop moves complex coefficients in.'''
+        return(phases(self.get_working_coefficients()))
+
+    def get_initial_steps(self):
+        '''This gives the starting step sizes for the adaptive variation: 5% of each coefficient, or 5% of the largest coefficient for the ones that are exactly zero, so those can move too.'''
+        magnitudes = np.abs(self.get_working_coefficients())
+        largest = magnitudes.max()
+        if(largest == 0):
+            largest = 1.0
+        return(np.where(magnitudes > 0, 0.05 * magnitudes, 0.05 * largest))
+
+    def do_variation(self, cutoff = 100000, etol = None, gtol = None, rtol = None, time_limit = None, adaptive = False, backend = 'numpy', callback = None):
+        '''This is the main variational loop. Each step probes every coefficient up and down and keeps the moves that lower the energy. By default every probe is 5% of the coefficient. With adaptive = True every coefficient gets its own step size instead, which grows by 1.2x while the coefficient keeps moving the same way and halves when it reverses or stalls (like Rprop).
+
+        The loop stops at the first of: no move lowers the energy ('stationary'), |dE| < etol ('energy'), the finite-difference gradient norm < gtol ('gradient'), |dE| < rtol*|E| ('rtol'), time_limit seconds have passed ('time'), or cutoff steps ('cutoff'). Returns a VariationResult saying which.
+
+        backend = 'numba' runs the whole loop in the compiled variation_kernel (see do_variation_numba). Without numba installed, with complex coefficients, or for finite differences (where the kernel's dense operator would be M x M, while this loop stays O(M) with the bands), it falls back to this NumPy loop.
+
+        If callback is given, it gets called as callback(nsteps, energy) after every step that moved the coefficients, e.g. to record the trajectory with results.ResultsWriter.'''
+        if(backend == 'numba' and numba is not None and not np.iscomplexobj(self.coefficients) and self.basis != 2):
+            return(self.do_variation_numba(cutoff, etol, gtol, rtol, time_limit, adaptive, callback = callback))
         #default cutoff is very many steps, but will ensure program won't go on forever
+        start = time.time()
         nsteps = 0
         done = False
+        reason = 'cutoff'
+        energy = self.get_energy()#also fills in the coefficients if there are none yet
+        self.coefficients = np.array(self.coefficients, dtype = np.result_type(np.asarray(self.coefficients).dtype, self.dtype))
+        gradient_norm = np.inf
+        if(adaptive):
+            steps = self.get_initial_steps()
+            last_changes = np.zeros(self.N, dtype = int)
+        hc = self.apply_H()#kept up to date as the coefficients move, and shared with the probes
         print("Starting...")
         while((not done) and (nsteps < cutoff)):
-            self.get_additions()
-            self.get_subtractions()
-#            print("CHANGES IS NOW {}".format(self.changes))
+            if(not adaptive):
+                steps = 0.05 * self.get_working_coefficients()
+                directions = 1.0
+            elif(np.iscomplexobj(self.coefficients)):
+                directions = self.get_phases()#move complex coefficients along their own phase, so the imaginary parts can change too
+            else:
+                directions = 1.0
+            e0, e_plus, e_minus = self.get_probe_energies(steps * directions, hc)
+            changes = np.where(e_minus < e0, -1, np.where(e_plus < e0, 1, 0))
+            gradient = np.divide(e_plus - e_minus, 2 * np.abs(steps), out = np.zeros(self.N, dtype = e_plus.dtype), where = (steps != 0))#only the norm is used, so the sign of the step doesn't matter
+            gradient_norm = np.linalg.norm(gradient)
             nsteps += 1
-            if(-1 in self.changes or 1 in self.changes):
-                for i in range(self.N):
-                    #actually update our coefficients
-                    self.coefficients[i] += 0.05 * self.changes[i] * self.coefficients[i]
-                    #reset the changes array
-                    self.changes[i] = 0
+            if(gtol is not None and gradient_norm < gtol):
+                reason = 'gradient'
+                done = True
+            elif(adaptive):
+                reversed_ = (changes * last_changes) < 0
+                used = np.where(reversed_, 0.5 * steps, steps)#back off when we overshoot
+                self.coefficients += (changes * used * directions).astype(self.coefficients.dtype)
+                steps = np.where((changes == 0) | reversed_, 0.5 * steps, 1.2 * steps)
+                scale = np.linalg.norm(self.get_working_coefficients())
+                steps = np.minimum(steps, scale)
+                last_changes = changes
+                if(not changes.any() and steps.max() < 1e-12 * scale):
+                    reason = 'stationary'
+                    done = True
+            elif(changes.any()):
+                #actually update our coefficients
+                self.coefficients += (changes * steps).astype(self.coefficients.dtype)
             else:
                 #then our changes were all 0
+                reason = 'stationary'
                 done = True
-            
-            
+            if(not done and changes.any()):
+                hc = self.apply_H()
+                new_energy = rayleigh_quotient(self.get_working_coefficients(), hc)
+                delta = abs(new_energy - energy)
+                energy = new_energy
+                if(callback is not None):
+                    callback(nsteps, energy)
+                if(etol is not None and delta < etol):
+                    reason = 'energy'
+                    done = True
+                elif(rtol is not None and delta < rtol * abs(energy)):
+                    reason = 'rtol'
+                    done = True
+            if(not done and time_limit is not None and time.time() - start > time_limit):
+                reason = 'time'
+                done = True
+        return(VariationResult(self.get_energy(), nsteps, reason, gradient_norm))
+
+    def do_variation_numba(self, cutoff = 100000, etol = None, gtol = None, rtol = None, time_limit = None, adaptive = False, chunk = 1000, callback = None):
+        '''This runs the same loop as do_variation inside the numba-compiled variation_kernel, on a contiguous float64 copy of the coefficients and the dense operator. Control only comes back to Python every chunk steps, to check the time budget and call the callback, so time_limit is only honored to within one chunk and the callback only sees every chunk-th step. Not for finite differences, which would need a dense M x M operator.'''
+        if(self.basis == 2):
+            raise ValueError("The numba kernel needs a dense operator; use do_variation for finite differences")
+        start = time.time()
+        energy = self.get_energy()#also fills in the coefficients if there are none yet
+        coefficients = np.array(self.get_working_coefficients(), dtype = np.float64)
+        operator = np.ascontiguousarray(self.get_operator(), dtype = np.float64)
+        if(adaptive):
+            steps = self.get_initial_steps()
+        else:
+            steps = np.zeros(self.N)
+        last_changes = np.zeros(self.N, dtype = np.int64)
+        #the kernel can't take None, so a negative tolerance means "not set"
+        tolerances = [-1.0 if tol is None else float(tol) for tol in (etol, gtol, rtol)]
+        nsteps = 0
+        reason = 'cutoff'
+        gradient_norm = np.inf
+        print("Starting...")
+        while(nsteps < cutoff):
+            taken, code, energy, gradient_norm = variation_kernel(operator, coefficients, steps, last_changes, adaptive, min(chunk, cutoff - nsteps), tolerances[0], tolerances[1], tolerances[2], energy)
+            nsteps += taken
+            if(callback is not None):
+                callback(nsteps, energy)
+            if(code != 0):
+                reason = STOP_REASONS[code]
+                break
+            if(time_limit is not None and time.time() - start > time_limit):
+                reason = 'time'
+                break
+        self.coefficients = coefficients.astype(np.asarray(self.coefficients).dtype)
+        return(VariationResult(self.get_energy(), nsteps, reason, gradient_norm))
+
+    def do_active_variation(self, cutoff = 100000, etol = None, rtol = None, time_limit = None, drop_tol = 1e-10, grow_tol = 1e-6, grow = 4, max_N = None, check_every = 20):
+        '''This is the adaptive do_variation loop run on an active set of modes instead of all N. Each step only probes and moves the active coefficients, so a step costs O(active^2) however big N is. Only the part of the operator the active set touches is kept: the symmetric part of its columns (all the energy sees), from get_operator_block, or for the diagonal Fourier operator just the active diagonal entries. Complex coefficients are moved along their own phases, as in do_variation.
+
+        Every check_every steps, and before stopping, the active set is redone. Mode j stays (or comes back) if |c_j| is at least drop_tol times the largest coefficient, or if moving it by that much would change the energy by at least drop_tol*|E| to first order; the rest are dropped to exactly zero. If the last grow modes still hold more than grow_tol of the norm, the series looks truncated, and N grows by grow (up to max_N, 2N by default). The loop stops the same ways do_variation does ('cutoff' is counted in steps), but only once the active set has settled. Finite differences have one value per grid point, so there is nothing to grow or drop there.'''
+        if(self.basis == 2):
+            raise ValueError("The active-set variation needs a spectral basis, not finite differences")
+        start = time.time()
+        energy = self.get_energy()#also fills in the coefficients if there are none yet
+        coefficients = self.get_working_coefficients()
+        N = self.N
+        if(max_N is None):
+            max_N = 2*N
+        max_N = max(max_N, N)
+        full = np.zeros(max_N, dtype = coefficients.dtype)
+        full[:N] = coefficients
+        all_steps = np.zeros(max_N)
+        all_steps[:N] = self.get_initial_steps()
+        all_last = np.zeros(max_N, dtype = int)
+        active = np.arange(N)
+        block = None
+        nsteps = 0
+        reason = 'cutoff'
+        gradient_norm = np.inf
+        print("Starting...")
+        while(nsteps < cutoff):
+            #pack the active set, rebuilding the operator block only when the set or N has changed
+            if(block is None):
+                if(self.basis == 1):
+                    block = self.get_operator_diagonal(active)
+                    sub = block
+                else:
+                    everything = np.arange(N)
+                    block = 0.5*(self.get_operator_block(everything, active) + self.get_operator_block(active, everything).T)
+                    sub = block[active]
+                diagonal = sub if sub.ndim == 1 else np.diag(sub).copy()
+            c = full[active]
+            steps = all_steps[active]
+            last_changes = all_last[active]
+            hc = block_dot(sub, c)
+            stop = None
+            for i in range(min(check_every, cutoff - nsteps)):
+                directions = phases(c) if np.iscomplexobj(c) else 1.0
+                e0, e_plus, e_minus = probe_energies(c, hc, hc, diagonal, steps * directions)
+                changes = np.where(e_minus < e0, -1, np.where(e_plus < e0, 1, 0))
+                gradient_norm = np.linalg.norm(np.divide(e_plus - e_minus, 2*steps, out = np.zeros(len(c), dtype = e_plus.dtype), where = (steps != 0)))
+                nsteps += 1
+                reversed_ = (changes * last_changes) < 0
+                c = c + changes * np.where(reversed_, 0.5 * steps, steps) * directions#back off when we overshoot
+                steps = np.minimum(np.where((changes == 0) | reversed_, 0.5 * steps, 1.2 * steps), np.linalg.norm(c))
+                last_changes = changes
+                if(not changes.any()):
+                    if(steps.max() < 1e-12 * np.linalg.norm(c)):
+                        stop = 'stationary'
+                        break
+                    continue
+                hc = block_dot(sub, c)
+                new_energy = rayleigh_quotient(c, hc)
+                delta = abs(new_energy - energy)
+                energy = new_energy
+                if(etol is not None and delta < etol):
+                    stop = 'energy'
+                    break
+                elif(rtol is not None and delta < rtol * abs(energy)):
+                    stop = 'rtol'
+                    break
+            #unpack, then redo the active set from the magnitudes and first-order energy sensitivities
+            full[active] = c
+            all_steps[active] = steps
+            all_last[active] = last_changes
+            largest = np.abs(full).max()
+            cc = np.real(np.vdot(c, c))
+            if(block.ndim == 1):
+                hc = np.zeros(N, dtype = c.dtype)
+                hc[active] = block * c
+            else:
+                hc = np.dot(block, c)
+            gradient = 2*np.abs(hc - energy*full[:N])/cc#|dE/dc_j| for every mode, active or not
+            keep = (np.abs(full[:N]) >= drop_tol * largest) | (gradient * largest >= abs(energy))#a move of drop_tol*largest changes E by drop_tol*|E|
+            new_active = np.flatnonzero(keep)
+            tail = np.linalg.norm(full[max(0, N - grow):N])/np.sqrt(cc)
+            if(tail > grow_tol and N < max_N):
+                new_active = np.concatenate([new_active, np.arange(N, min(N + grow, max_N))])
+                N = min(N + grow, max_N)
+                self.set_N(N)
+            entering = np.setdiff1d(new_active, active)
+            all_steps[entering] = 0.05 * largest#these start from zero, or from being dropped
+            all_last[entering] = 0
+            full[np.setdiff1d(active, new_active)] = 0.0
+            settled = np.array_equal(new_active, active)#growing N always adds to the active set
+            if(not settled):
+                block = None
+            active = new_active
+            if(stop is not None and settled):
+                reason = stop
+                break
+            if(time_limit is not None and time.time() - start > time_limit):
+                reason = 'time'
+                break
+        self.active = active
+        self.set_N(N)
+        self.coefficients = full[:N].astype(np.result_type(np.asarray(self.coefficients).dtype, self.dtype))
+        return(VariationResult(self.get_energy(), nsteps, reason, gradient_norm))
+
+    def get_lowest_states(self, k, tol = 1e-8, maxiter = 1000, seed = 0):
+        '''This finds the k lowest-energy states at once with a block iteration in the style of LOBPCG. Each step does a Rayleigh-Ritz solve in the span of the current k vectors, their residuals and their previous search directions, so the Hamiltonian is applied to the whole block in one matrix-matrix product instead of k separate runs. Since get_energy is c.Hc/c.c, only the symmetric part of the operator matters. For finite differences the block goes through the bands (band_dot) instead, so nothing M x M is ever built; get_lowest_states_sparse converges much faster there if scipy is around. The coefficients are set to the lowest state. Returns the k energies, lowest first, and a (k, N) array of normalized coefficients.'''
+        self.fill_coefficients()#sets N to the number of points for finite differences
+        if(k > self.N):
+            raise ValueError("Can't find {} states with only {} basis functions".format(k, self.N))
+        if(self.basis == 2):
+            self.get_hmat_fd()
+            apply = lambda vectors: 0.5*(band_dot(self.fd_bands, vectors) + band_dot(self.fd_bands, vectors, transpose = True))*(-self.c) + self.v*vectors
+        else:
+            operator = self.get_operator()
+            operator = 0.5 * (operator + operator.T)
+            apply = lambda vectors: np.dot(operator, vectors)
+        block = np.linalg.qr(np.random.RandomState(seed).standard_normal((self.N, k)))[0]
+        h_block = apply(block)
+        energies = np.diag(np.dot(block.T, h_block))
+        directions = np.zeros((self.N, 0))
+        for iteration in range(maxiter):
+            residuals = h_block - block * energies
+            if(np.linalg.norm(residuals, axis = 0).max() < tol):
+                break
+            search = np.hstack([residuals, directions])
+            for i in range(2):#twice is enough to be orthogonal to the block in floating point
+                search -= np.dot(block, np.dot(block.T, search))
+            u, sigma, vt = np.linalg.svd(search, full_matrices = False)
+            search = u[:, sigma > 1e-12 * max(sigma.max(), 1.0)]
+            basis = np.hstack([block, search])
+            h_basis = apply(basis)
+            ritz_values, ritz_vectors = np.linalg.eigh(np.dot(basis.T, h_basis))
+            ritz_vectors = ritz_vectors[:, :k]
+            energies = ritz_values[:k]
+            block = np.dot(basis, ritz_vectors)
+            h_block = np.dot(h_basis, ritz_vectors)
+            directions = np.dot(search, ritz_vectors[k:])
+        self.coefficients = block[:, 0].astype(self.dtype)#the states are real
+        return(energies, block.T.copy())
+
+
+class VariationResult:
+    '''This holds the outcome of a do_variation run: the final energy, how many steps were taken, the last gradient norm estimate and why the loop stopped.'''
+    def __init__(self, energy, nsteps, reason, gradient_norm):
+        self.energy = energy
+        self.nsteps = nsteps
+        self.reason = reason#'stationary', 'energy', 'gradient', 'rtol', 'time' or 'cutoff'
+        self.gradient_norm = gradient_norm
+        self.converged = reason not in ('time', 'cutoff')
+
+    def __repr__(self):
+        return("VariationResult(energy={}, nsteps={}, reason='{}')".format(self.energy, self.nsteps, self.reason))
+
+
+class Solution:
+    '''This is a converged wavefunction, boiled down to its coefficients plus the few numbers needed to evaluate it: the basis, the ends of the axis and the period. Calling it evaluates the wavefunction (or a derivative) at any array of x values, chunk points at a time so memory stays bounded: Clenshaw's recurrence for Legendre and Chebyshev series, and Horner's rule in exp(2 pi i x/period) for Fourier series. It is just arrays and numbers, so it pickles small and cheap.'''
+    def __init__(self, coefficients, basis, lower, upper, period, real_fourier = False, axis = None):
+        self.coefficients = np.asarray(coefficients)
+        self.basis = basis#same numbering as Grid.basis
+        self.lower = lower
+        self.upper = upper
+        self.period = period
+        self.real_fourier = real_fourier
+        self.axis = axis#only needed for finite differences, where the coefficients are values on it
+
+    def __call__(self, x, derivative = 0, chunk = 4096):
+        '''This evaluates the wavefunction, or its derivative-th derivative, at x.'''
+        x = np.asarray(x, dtype = np.float64)
+        flat = x.ravel()
+        coefficients = self.get_derivative_coefficients(derivative)
+        values = np.empty(len(flat))
+        for start in range(0, len(flat), chunk):
+            values[start:start + chunk] = self.evaluate(flat[start:start + chunk], coefficients)
+        return(values.reshape(x.shape))
+
+    def get_derivative_coefficients(self, derivative):
+        '''This returns the coefficients of the derivative-th derivative, in whatever form evaluate wants for this basis.'''
+        if(self.basis == 0):
+            return(L.legder(self.coefficients, derivative) if derivative > 0 else self.coefficients)
+        elif(self.basis == 3):
+            scale = (2.0/(self.upper - self.lower))**derivative
+            coefficients = self.coefficients
+            for i in range(derivative):
+                coefficients = chebyshev_derivative(coefficients)
+            return(coefficients * scale)
+        elif(self.basis == 2):
+            values = self.coefficients
+            for i in range(derivative):
+                values = np.gradient(values, self.axis)
+            return(values)
+        #Fourier: make the series Re(sum b_n z^n) with z = exp(2 pi i x/period)
+        if(self.real_fourier):
+            modes = np.arange((len(self.coefficients) + 2)//2)
+            b = np.zeros(len(modes), dtype = complex)
+            b[0] = self.coefficients[0]
+            b[1:] += 2*self.coefficients[1::2]
+            sines = self.coefficients[2::2]
+            b[1:len(sines) + 1] -= 2j*sines
+        else:
+            modes = np.arange(len(self.coefficients))
+            b = 2*self.coefficients.astype(complex)
+            b[0] /= 2
+        return(b * (2j*np.pi*modes/self.period)**derivative)
+
+    def evaluate(self, x, coefficients):
+        '''This evaluates the series with the given coefficients at the points x.'''
+        if(self.basis == 0):
+            return(L.legval(x, coefficients))
+        elif(self.basis == 3):
+            return(C.chebval((2*x - (self.lower + self.upper))/(self.upper - self.lower), coefficients))
+        elif(self.basis == 2):
+            return(np.interp(x, self.axis, coefficients))
+        z = np.exp(2j*np.pi*x/self.period)
+        total = np.zeros(len(x), dtype = complex) + coefficients[-1]
+        for n in range(len(coefficients) - 2, -1, -1):
+            total = total*z + coefficients[n]
+        return(total.real)
+
+
+class Propagator:
+    '''This evolves a wavefunction on the axis of a Grid with the split-operator method: half a potential step in real space, a kinetic step in Fourier space (np.fft along the axis, so the axis must be evenly spaced and is treated as periodic), and another half potential step. The Hamiltonian is -c d^2/dx^2 + V, with V the grid's constant potential unless a potential array is given. All the phase factors are computed once up front. In imaginary time the phases become decays, and renormalizing after every step relaxes any starting wavefunction to the ground state.'''
+    def __init__(self, grid, dt, imaginary = False, potential = None):
+        self.grid = grid
+        self.dt = dt
+        self.imaginary = imaginary
+        x = grid.axis.astype(np.float64)
+        spacing = np.diff(x)
+        self.dx = (x[-1] - x[0])/(len(x) - 1)
+        if(not np.allclose(spacing, self.dx, rtol = 1e-3)):
+            raise ValueError("The split-operator propagator needs an evenly spaced axis")
+        if(potential is None):
+            potential = grid.v
+        self.potential = np.zeros(len(x)) + potential
+        self.kinetic = grid.c * (2*np.pi*np.fft.fftfreq(len(x), self.dx))**2
+        if(imaginary):
+            factor = -dt
+        else:
+            factor = -1j*dt
+        self.cdtype = np.result_type(grid.dtype, np.complex64)
+        self.half_potential_phase = np.exp(factor * self.potential / 2).astype(self.cdtype)
+        self.potential_phase = np.exp(factor * self.potential).astype(self.cdtype)
+        self.kinetic_phase = np.exp(factor * self.kinetic).astype(self.cdtype)
+        if(len(grid.wavefunc) > 0):
+            self.psi = np.array(grid.wavefunc, dtype = self.cdtype)
+        else:
+            self.psi = np.ones(len(x), dtype = self.cdtype)#flat starting guess
+        self.normalize()
+        self.time = 0.0
+        self.nsteps = 0
+
+    def get_norm(self):
+        '''This returns the norm of the wavefunction, sqrt(sum |psi|^2 dx).'''
+        return(float(np.sqrt(np.sum(np.abs(self.psi)**2) * self.dx)))
+
+    def normalize(self):
+        '''This rescales the wavefunction to unit norm.'''
+        self.psi /= self.get_norm()
+
+    def get_energy(self):
+        '''This returns <psi|H|psi>/<psi|psi>, taking the kinetic part in Fourier space via Parseval's theorem.'''
+        density = np.abs(self.psi)**2
+        spectrum = np.abs(np.fft.fft(self.psi))**2
+        kinetic = np.sum(self.kinetic * spectrum) / len(self.psi)
+        return(float((kinetic + np.sum(self.potential * density)) / np.sum(density)))
+
+    def get_position(self):
+        '''This returns the expectation value of x.'''
+        density = np.abs(self.psi)**2
+        return(float(np.sum(self.grid.axis * density) / np.sum(density)))
+
+    def kinetic_step(self):
+        '''This applies the cached kinetic phases in Fourier space.'''
+        self.psi = np.fft.ifft(self.kinetic_phase * np.fft.fft(self.psi)).astype(self.cdtype, copy = False)
+
+    def step(self):
+        '''This takes a single symmetric (Strang) split-operator step of length dt.'''
+        self.psi *= self.half_potential_phase
+        self.kinetic_step()
+        self.psi *= self.half_potential_phase
+        if(self.imaginary):
+            self.normalize()
+        self.nsteps += 1
+        self.time += self.dt
+
+    def run(self, nsteps, every = 1, observables = None):
+        '''This takes nsteps steps and yields (step, time, values) every "every" steps, where values maps each observable name to its value right then. observables is a dict of name -> function of this Propagator, defaulting to the energy, norm and position. Only the current wavefunction is kept, so long runs use constant memory. Between outputs, neighboring half potential steps are merged into single full ones.'''
+        if(observables is None):
+            observables = {'energy': Propagator.get_energy, 'norm': Propagator.get_norm, 'position': Propagator.get_position}
+        done = 0
+        while(done < nsteps):
+            block = min(every, nsteps - done)
+            self.psi *= self.half_potential_phase
+            for i in range(block):
+                self.kinetic_step()
+                if(i < block - 1):
+                    self.psi *= self.potential_phase
+                if(self.imaginary):
+                    self.normalize()
+            self.psi *= self.half_potential_phase
+            if(self.imaginary):
+                self.normalize()
+            done += block
+            self.nsteps += block
+            self.time += block * self.dt
+            yield(self.nsteps, self.time, dict((name, function(self)) for name, function in observables.items()))
+
+
+def chebyshev_dct(values):
+    '''This turns values at the Chebyshev-Gauss-Lobatto points cos(pi j/n), j = 0..n, into the coefficients of the interpolating Chebyshev series. That is a type-I DCT, which we do as a real FFT of the values extended evenly to length 2n.'''
+    n = len(values) - 1
+    if(n == 0):
+        return(np.array(values, dtype = np.float64))
+    extended = np.concatenate([values, values[n-1:0:-1]])
+    coefficients = np.fft.rfft(extended).real / n
+    coefficients[0] /= 2
+    coefficients[n] /= 2
+    return(coefficients)
+
+def lambda_ratio(z):
+    '''Returns Gamma(z + 1/2)/Gamma(z + 1) for an array of z, through log-gamma so large z don't overflow.'''
+    z = np.asarray(z, dtype = np.float64)
+    return(np.exp(np.array([math.lgamma(x + 0.5) - math.lgamma(x + 1.0) for x in z.ravel()])).reshape(z.shape))
+
+def hankel_factors(moments, n, tol = 1e-16):
+    '''This factors the n x n Hankel matrix H_ij = moments[i + j] as the sum of u u^T over the rows u of the returned array, by pivoted Cholesky, stopping once what is left is below tol of the largest diagonal entry. The Hankel parts of the Chebyshev-Legendre conversions are moment matrices of positive measures, so this works, and their rank only grows like log(n).'''
+    diagonal = moments[2*np.arange(n)].astype(np.float64)
+    largest = diagonal.max() if n > 0 else 0.0
+    factors = []
+    while(len(factors) < n):
+        pivot = int(np.argmax(diagonal))
+        if(diagonal[pivot] <= tol * largest):
+            break
+        column = moments[np.arange(n) + pivot].astype(np.float64)
+        for u in factors:
+            column -= u * u[pivot]
+        u = column / np.sqrt(diagonal[pivot])
+        factors.append(u)
+        diagonal -= u**2
+        diagonal[pivot] = 0.0
+    return(np.array(factors).reshape(len(factors), n))
+
+def upper_toeplitz_dot(symbol, x):
+    '''Returns y_i = sum over d >= 0 of symbol[d] x[i + d], an upper-triangular Toeplitz matrix times x, as one FFT convolution.'''
+    n = len(x)
+    size = 1 << (2*n - 1).bit_length()
+    return(np.fft.irfft(np.fft.rfft(x[::-1], size) * np.fft.rfft(symbol, size), size)[:n][::-1])
+
+def get_transform_plan(direction, n):
+    '''This sets up, once per size, the Toeplitz symbol and Hankel factors for converting n Legendre coefficients to Chebyshev ones ('leg2cheb') or back ('cheb2leg'). Both conversion matrices are diagonal scalings of the entrywise product of an upper Toeplitz matrix and a Hankel matrix (Alpert and Rokhlin's formulas, in terms of lambda_ratio), and writing the Hankel part as a short sum of rank-one terms turns each conversion into a few FFT convolutions.'''
+    key = (direction, n)
+    if(key not in TRANSFORM_PLANS):
+        d = np.arange(n)
+        if(direction == 'leg2cheb'):
+            #a_k = (2/pi) sum over n >= k, n - k even, of Lambda((n - k)/2) Lambda((n + k)/2) b_n, halved for k = 0
+            symbol = np.where(d % 2 == 0, lambda_ratio(d/2.0), 0.0)
+            factors = hankel_factors(lambda_ratio(np.arange(2*n)/2.0), n)
+        else:
+            #b_n = a_n sqrt(pi)/(2 Lambda(n)) - (n + 1/2) sum over k >= n + 2, k - n even, of k Lambda((k - n - 2)/2)/(k - n) Lambda((k + n - 1)/2)/(k + n + 1) a_k, with column k stored at k - 2
+            symbol = np.where(d % 2 == 0, lambda_ratio(d/2.0)/(d + 2.0), 0.0)
+            m = np.arange(2*n) + 2.0
+            factors = hankel_factors(lambda_ratio((m - 1)/2.0)/(m + 1), n)
+        TRANSFORM_PLANS[key] = (symbol, factors)
+    return(TRANSFORM_PLANS[key])
+
+def legendre_to_chebyshev(coefficients):
+    '''This converts a Legendre series to the Chebyshev series of the same polynomial in O(N log N) (see get_transform_plan).'''
+    b = np.asarray(coefficients, dtype = np.float64)
+    symbol, factors = get_transform_plan('leg2cheb', len(b))
+    a = np.zeros(len(b))
+    for u in factors:
+        a += u * upper_toeplitz_dot(symbol, u * b)
+    a *= 2/np.pi
+    a[0] /= 2
+    return(a)
+
+def chebyshev_to_legendre(coefficients):
+    '''This converts a Chebyshev series to the Legendre series of the same polynomial in O(N log N) (see get_transform_plan).'''
+    a = np.asarray(coefficients, dtype = np.float64)
+    n = len(a)
+    k = np.arange(n)
+    symbol, factors = get_transform_plan('cheb2leg', n)
+    shifted = np.zeros(n)
+    shifted[:n-2] = (k * a)[2:]
+    b = np.zeros(n)
+    for u in factors:
+        b += u * upper_toeplitz_dot(symbol, u * shifted)
+    diagonal = np.sqrt(np.pi)/(2*lambda_ratio(k))
+    diagonal[0] = 1.0
+    return(diagonal * a - (k + 0.5) * b)
+
+def shen_mass_factor(n):
+    '''This returns the Cholesky factor F of the mass matrix of psi_k = L_(k+2) - L_k, k = 0..n-1, as its diagonal and its only other band, F_(k,k-2). These span the same polynomials as the hard-wall Chebyshev functions T_(k+2) - T_k (everything of degree up to k+2 that vanishes at both ends), so Gram-Schmidt on either gives the same orthonormal functions F^-1 psi, which are our basis 3. The difference is that here the mass matrix is pentadiagonal, int psi_j psi_k dt = 2/(2k+1) + 2/(2k+5) on the diagonal and -2/(2k+5) two off it, and the stiffness int psi_j' psi_k' dt is just 2(2k+3) on the diagonal, since psi_k' = (2k+3) L_(k+1).'''
+    if(n not in SHEN_FACTORS):
+        k = np.arange(n)
+        mass_diagonal = 2.0/(2*k + 1) + 2.0/(2*k + 5)
+        mass_band = -2.0/(2*k + 5)#M_(k,k+2)
+        diagonal = np.zeros(n)
+        band = np.zeros(n)
+        for i in range(n):
+            if(i >= 2):
+                band[i] = mass_band[i-2]/diagonal[i-2]
+            diagonal[i] = np.sqrt(mass_diagonal[i] - band[i]**2)
+        diagonal.flags.writeable = False
+        band.flags.writeable = False
+        SHEN_FACTORS[n] = (diagonal, band)
+    return(SHEN_FACTORS[n])
+
+def solve_two_step(a, b):
+    '''This solves the recurrence x_i = a_i x_(i-2) + b_i (with a_0 and a_1 ignored) in O(n) without a Python loop: along each parity x = P cumsum(b/P), with P the running product of the a's. The a's that come up here are all just under 1 in size, so P only decays like a power of i. Works column by column on 2D b.'''
+    b = np.asarray(b, dtype = np.float64)
+    x = np.empty(b.shape)
+    for parity in (0, 1):
+        steps = np.array(a[parity::2], dtype = np.float64)
+        if(len(steps) == 0):
+            continue
+        steps[0] = 1.0
+        products = np.cumprod(steps).reshape((-1,) + (1,)*(b.ndim - 1))
+        x[parity::2] = products * np.cumsum(b[parity::2]/products, axis = 0)
+    return(x)
+
+def shen_solve(y, transpose = False):
+    '''This solves F x = y, or F^T x = y with transpose = True, for the banded Cholesky factor F from shen_mass_factor, in O(N). Works column by column on 2D y.'''
+    y = np.asarray(y, dtype = np.float64)
+    n = y.shape[0]
+    diagonal, band = shen_mass_factor(n)
+    scale = diagonal.reshape((n,) + (1,)*(y.ndim - 1))
+    if(not transpose):
+        return(solve_two_step(-band/diagonal, y/scale))
+    steps = np.zeros(n)
+    steps[:n-2] = -band[2:]/diagonal[:n-2]#x_i = (y_i - F_(i+2,i) x_(i+2))/F_ii, run backwards
+    return(solve_two_step(steps[::-1], (y/scale)[::-1])[::-1])
+
+def shen_kinetic(coefficients):
+    '''This applies the kinetic part of the basis 3 Hamiltonian on [-1, 1], F^-1 S F^-T, to orthonormal coefficients, in O(N): F^-T takes them to psi coefficients, S is the diagonal stiffness 2(2k+3), and F^-1 takes the resulting integrals back (see shen_mass_factor). Works column by column on 2D arrays.'''
+    coefficients = np.asarray(coefficients, dtype = np.float64)
+    n = coefficients.shape[0]
+    stiffness = (2.0*(2*np.arange(n) + 3)).reshape((n,) + (1,)*(coefficients.ndim - 1))
+    return(shen_solve(stiffness * shen_solve(coefficients, transpose = True)))
+
+def shen_kinetic_diagonal(n):
+    '''Returns the diagonal of F^-1 S F^-T (see shen_kinetic) in O(n). Entry (k, j) of F^-1 is P_k/(P_j F_jj) for j <= k of the same parity, with P the running product of -F_(i,i-2)/F_ii along each parity, so the diagonal is P_k^2 times a cumulative sum.'''
+    diagonal, band = shen_mass_factor(n)
+    stiffness = 2.0*(2*np.arange(n) + 3)
+    result = np.zeros(n)
+    for parity in (0, 1):
+        steps = -band[parity::2]/diagonal[parity::2]
+        if(len(steps) == 0):
+            continue
+        steps[0] = 1.0
+        products = np.cumprod(steps)
+        result[parity::2] = products**2 * np.cumsum(stiffness[parity::2]/(products * diagonal[parity::2])**2)
+    return(result)
+
+def chebyshev_derivative(coefficients):
+    '''This returns the Chebyshev coefficients of the derivative, padded with a zero to the same length, in O(N). The standard recurrence d_k = d_(k+2) + 2(k+1) a_(k+1) just sums 2j a_j over every other j above k, so it comes down to two reversed cumulative sums, one for each parity. Works column by column on 2D arrays.'''
+    a = np.asarray(coefficients)
+    n = a.shape[0]
+    weighted = (2*np.arange(n)).reshape((n,) + (1,)*(a.ndim - 1)) * a
+    derivative = np.zeros(a.shape, dtype = np.result_type(a, np.float64))
+    zero = np.zeros((1,) + a.shape[1:])
+    odd_tails = np.concatenate([np.cumsum(weighted[1::2][::-1], axis = 0)[::-1], zero])#sum of weighted[j] for odd j >= 2m+1
+    even_tails = np.concatenate([np.cumsum(weighted[0::2][::-1], axis = 0)[::-1], zero])#sum of weighted[j] for even j >= 2m
+    derivative[0::2] = odd_tails[:(n + 1)//2]
+    derivative[1::2] = even_tails[1:n//2 + 1]
+    derivative[0] /= 2
+    return(derivative)
+
+def fd_weights(axis, order, chunk = 65536):
+    '''This finds the second-derivative stencil weights of the given order (2, 4 or 6) at every point of a possibly uneven axis, with Fornberg's recurrence run on chunk rows at a time. Each point uses itself and order/2 neighbours on each side. The wavefunction vanishes at a wall one end-spacing past each end of the axis, and the ghost points beyond the wall are mirror images with the opposite sign, so their weights fold back onto real points. Returns an (order+1, M) array where row order/2 + k holds the weight of point i+k for each point i.'''
+    p = order//2
+    x = np.asarray(axis, dtype = np.float64)
+    M = len(x)
+    #positions of the p points past each end, starting with the walls
+    left_wall = x[0] - (x[1] - x[0])
+    right_wall = x[-1] + (x[-1] - x[-2])
+    left = 2*left_wall - x[p - 2::-1] if p > 1 else np.zeros(0)
+    right = 2*right_wall - x[:-p:-1] if p > 1 else np.zeros(0)
+    padded = np.concatenate([left, [left_wall], x, [right_wall], right])
+    bands = np.empty((2*p + 1, M))
+    for start in range(0, M, chunk):
+        rows = np.arange(start, min(start + chunk, M))
+        offsets = padded[rows[:, None] + np.arange(2*p + 1)[None, :]] - x[rows][:, None]
+        spacing = 0.5*(offsets[:, p + 1] - offsets[:, p - 1])
+        nodes = (offsets / spacing[:, None]).T#scaled to keep the recurrence well conditioned
+        weights = np.zeros((2*p + 1, 3, len(rows)))
+        weights[0, 0] = 1.0
+        c1 = np.ones(len(rows))
+        c4 = nodes[0].copy()
+        for i in range(1, 2*p + 1):
+            c2 = np.ones(len(rows))
+            c5 = c4
+            c4 = nodes[i]
+            for j in range(i):
+                c3 = nodes[i] - nodes[j]
+                c2 = c2*c3
+                if(j == i - 1):
+                    for k in range(min(i, 2), 0, -1):
+                        weights[i, k] = c1*(k*weights[i - 1, k - 1] - c5*weights[i - 1, k])/c2
+                    weights[i, 0] = -c1*c5*weights[i - 1, 0]/c2
+                for k in range(min(i, 2), 0, -1):
+                    weights[j, k] = (c4*weights[j, k] - k*weights[j, k - 1])/c3
+                weights[j, 0] = c4*weights[j, 0]/c3
+            c1 = c2
+        bands[:, rows] = weights[:, 2] / spacing**2
+    #fold the ghost points onto their mirror images and drop the walls
+    for i in range(min(p, M)):
+        for k in range(-p, p + 1):
+            ghost = i + k
+            if(ghost == -1 or ghost == M):
+                bands[p + k, i] = 0.0
+            elif(ghost < -1):
+                bands[p + (-2 - ghost) - i, i] -= bands[p + k, i]
+                bands[p + k, i] = 0.0
+        i = M - 1 - i
+        for k in range(-p, p + 1):
+            ghost = i + k
+            if(ghost > M):
+                bands[p + (2*M - ghost) - i, i] -= bands[p + k, i]
+                bands[p + k, i] = 0.0
+    return(bands)
+
+def fd_cell_widths(axis):
+    '''This returns the width (x[i+1] - x[i-1])/2 of the cell around each point, relative to the average, with the walls one end-spacing past each end of the axis.'''
+    x = np.asarray(axis, dtype = np.float64)
+    padded = np.concatenate([[2*x[0] - x[1]], x, [2*x[-1] - x[-2]]])
+    widths = 0.5*(padded[2:] - padded[:-2])
+    return(widths / widths.mean())
+
+def band_dot(bands, u, transpose = False):
+    '''This multiplies the banded matrix stored by fd_weights (or its transpose) with the vector u in O(M * bandwidth). u can also be an (M, k) block, which gets multiplied column by column.'''
+    p = (bands.shape[0] - 1)//2
+    M = len(u)
+    out = np.zeros(np.shape(u), dtype = np.result_type(bands, u))
+    for k in range(-p, p + 1):
+        w = bands[p + k].reshape((M,) + (1,)*(np.ndim(u) - 1))
+        if(k >= 0 and not transpose):
+            out[:M - k] += w[:M - k]*u[k:]
+        elif(k < 0 and not transpose):
+            out[-k:] += w[-k:]*u[:M + k]
+        elif(k >= 0):
+            out[k:] += w[:M - k]*u[:M - k]
+        else:
+            out[:M + k] += w[-k:]*u[-k:]
+    return(out)
+
+def bands_to_dense(bands):
+    '''This expands the banded matrix stored by fd_weights into a dense one. Only for small grids!'''
+    p = (bands.shape[0] - 1)//2
+    M = bands.shape[1]
+    dense = np.zeros((M, M))
+    for k in range(-p, p + 1):
+        rows = np.arange(max(0, -k), min(M, M - k))
+        dense[rows, rows + k] = bands[p + k, rows]
+    return(dense)
+
+def rayleigh_quotient(coefficients, hc):
+    '''This is the energy Re(c*.Hc)/c*.c, given hc = Hc.'''
+    return(np.real(np.vdot(coefficients, hc))/np.real(np.vdot(coefficients, coefficients)))
+
+def phases(coefficients):
+    '''Returns c_i/|c_i| for every coefficient, and 1 where it is zero.'''
+    magnitudes = np.abs(coefficients)
+    return(np.divide(coefficients, magnitudes, out = np.ones(len(coefficients), dtype = coefficients.dtype), where = (magnitudes > 0)))
+
+def block_dot(block, coefficients):
+    '''This applies an operator block kept by do_active_variation: a matrix, or for a diagonal operator just the 1D array of its diagonal.'''
+    if(block.ndim == 1):
+        return(block*coefficients)
+    return(np.dot(block, coefficients))
+
+def probe_energies(coefficients, hc, htc, diag, steps):
+    '''This gives the energies E(c + s e_i) and E(c - s e_i) for every coefficient i at once, where s = steps[i]. Expanding the Rayleigh quotient, the numerator is c.Hc + s((Hc)_i + (H^T c)_i) + s^2 H_ii and the denominator is c.c + 2 s c_i + s^2, so we only need Hc, H^T c and the diagonal of H. For complex coefficients or steps the same expansion of Re(c*.Hc)/c*.c works with conj(s) in front of (Hc)_i and |s|^2 for s^2 (our operators are all real, so H^T c is also H^H c). Returns the unmoved energy and the two arrays of probed energies.'''
+    chc = np.real(np.vdot(coefficients, hc))
+    cc = np.real(np.vdot(coefficients, coefficients))
+    if(np.iscomplexobj(coefficients) or np.iscomplexobj(steps)):
+        linear = np.real(np.conj(steps) * hc + steps * np.conj(htc))
+        norm_linear = 2 * np.real(np.conj(steps) * coefficients)
+        norm_quadratic = np.abs(steps)**2
+        quadratic = norm_quadratic * np.real(diag)
+    else:
+        linear = steps * (hc + htc)
+        norm_linear = 2 * steps * coefficients
+        norm_quadratic = steps**2
+        quadratic = steps**2 * diag
+    e_plus = (chc + linear + quadratic)/(cc + norm_linear + norm_quadratic)
+    e_minus = (chc - linear + quadratic)/(cc - norm_linear + norm_quadratic)
+    return(chc/cc, e_plus, e_minus)
+
+
+def kernel_apply(operator, coefficients, hc, htc):
+    '''This fills hc with H c and htc with H^T c in a single row-major pass over the operator, and returns c.Hc and c.c.'''
+    n = coefficients.shape[0]
+    for i in range(n):
+        hc[i] = 0.0
+        htc[i] = 0.0
+    chc = 0.0
+    cc = 0.0
+    for i in range(n):
+        ci = coefficients[i]
+        row = 0.0
+        for j in range(n):
+            row += operator[i, j] * coefficients[j]
+            htc[j] += operator[i, j] * ci
+        hc[i] = row
+        chc += ci * row
+        cc += ci * ci
+    return(chc, cc)
+
+def variation_kernel(operator, coefficients, steps, last_changes, adaptive, max_steps, etol, gtol, rtol, energy):
+    '''This is the do_variation loop written out with plain loops over contiguous float64 arrays, so numba can compile it in nopython mode. The coefficients, steps and last_changes arrays are updated in place; tolerances below zero are ignored. Returns the number of steps taken, an index into STOP_REASONS, the energy and the last gradient norm.'''
+    n = coefficients.shape[0]
+    hc = np.zeros(n)
+    htc = np.zeros(n)
+    changes = np.zeros(n, dtype = np.int64)
+    nsteps = 0
+    code = 0
+    gradient_norm = np.inf
+    chc, cc = kernel_apply(operator, coefficients, hc, htc)
+    while(nsteps < max_steps):
+        e0 = chc/cc
+        moved = False
+        gradient_sum = 0.0
+        for i in range(n):
+            if(not adaptive):
+                steps[i] = 0.05 * coefficients[i]
+            s = steps[i]
+            linear = s * (hc[i] + htc[i])
+            quadratic = s * s * operator[i, i]
+            e_plus = (chc + linear + quadratic)/(cc + 2 * s * coefficients[i] + s * s)
+            e_minus = (chc - linear + quadratic)/(cc - 2 * s * coefficients[i] + s * s)
+            if(e_minus < e0):
+                changes[i] = -1
+            elif(e_plus < e0):
+                changes[i] = 1
+            else:
+                changes[i] = 0
+            if(changes[i] != 0):
+                moved = True
+            if(s != 0):
+                gradient_sum += ((e_plus - e_minus)/(2 * s))**2
+        gradient_norm = np.sqrt(gradient_sum)
+        nsteps += 1
+        if(gtol >= 0 and gradient_norm < gtol):
+            code = 3
+            break
+        if(adaptive):
+            for i in range(n):
+                reverse = changes[i] * last_changes[i] < 0
+                if(reverse):
+                    coefficients[i] += changes[i] * 0.5 * steps[i]#back off when we overshoot
+                else:
+                    coefficients[i] += changes[i] * steps[i]
+                if(changes[i] == 0 or reverse):
+                    steps[i] *= 0.5
+                else:
+                    steps[i] *= 1.2
+                last_changes[i] = changes[i]
+            scale = np.sqrt(np.sum(coefficients * coefficients))
+            largest = 0.0
+            for i in range(n):
+                steps[i] = min(steps[i], scale)
+                largest = max(largest, steps[i])
+            if(not moved and largest < 1e-12 * scale):
+                code = 1
+                break
+        elif(moved):
+            for i in range(n):
+                coefficients[i] += changes[i] * steps[i]
+        else:
+            code = 1
+            break
+        if(moved):
+            chc, cc = kernel_apply(operator, coefficients, hc, htc)#also ready for the next step
+            delta = abs(chc/cc - energy)
+            energy = chc/cc
+            if(etol >= 0 and delta < etol):
+                code = 2
+                break
+            elif(rtol >= 0 and delta < rtol * abs(energy)):
+                code = 4
+                break
+    return(nsteps, code, energy, gradient_norm)
+
+if(numba is not None):
+    kernel_apply = numba.njit(kernel_apply)
+    variation_kernel = numba.njit(variation_kernel)
+
+
 def read_file(filename):
     '''This reads in a file containing the x-axis for our wavefunction.'''
     coords = [] 
@@ -183,28 +1279,109 @@ def read_file(filename):
     return(Grid(coords))
 
 def read_input(filename = 'fourier_test_input.txt'):
-    '''This reads an input file with our chosen formatting.'''
+    '''This reads an input file with our chosen formatting and returns the Grid for it (for the first job, if the file has several; see read_jobs).'''
+    return(make_grid(parse_jobs(filename)[0]))
+
+def read_jobs(filename, axes = None):
+    '''This reads every job in an input file and returns a list of Grids. All the input is parsed and checked before any Grid gets built, and each distinct TARGET axis is read from disk only once and shared, read-only, by all the Grids that use it. Pass a dict as axes to share them across several files too.'''
+    if(axes is None):
+        axes = {}
+    return([make_grid(job, axes) for job in parse_jobs(filename)])
+
+def parse_jobs(filename):
+    '''This parses an input file into a list of validated jobs, each a dict of KEYWORDS to values. Files ending in .json or .toml hold a "jobs" list of tables, plus optional "defaults" that every job starts from; keywords can be in any case. Anything else is read as the original one-job format of "KEYWORD value" lines, in any order.'''
+    if(filename.endswith('.json')):
+        with open(filename) as f:
+            data = json.load(f)
+    elif(filename.endswith('.toml')):
+        if(tomllib is None):
+            raise ImportError("Reading TOML input needs python 3.11 or the tomli package")
+        with open(filename, 'rb') as f:
+            data = tomllib.load(f)
+    else:
+        data = {'jobs': [parse_legacy_input(filename)]}
+    if(isinstance(data, list)):
+        data = {'jobs': data}
+    if(not isinstance(data, dict) or not isinstance(data.get('jobs'), list) or len(data['jobs']) == 0):
+        raise ValueError("{}: expected a non-empty list of jobs".format(filename))
+    defaults = data.get('defaults', {})
+    jobs = []
+    for i, job in enumerate(data['jobs']):
+        settings = dict((key.upper(), value) for key, value in defaults.items())
+        settings.update((key.upper(), value) for key, value in job.items())
+        jobs.append(validate_job(settings, "{}, job {}".format(filename, i)))
+    return(jobs)
+
+def parse_legacy_input(filename):
+    '''This reads the original input format, one "KEYWORD value" per line, into a dict. The keyword has to be the whole first word of the line, and the FUNCTION value is whatever is between the single quotes. Blank lines and lines starting with # are skipped.'''
+    settings = {}
     with open(filename) as f:
-        for line in f:
-            if('TARGET' in line):
-                target = (line.split(' ')[1]).split('\n')[0]
-                grid = read_file(target)
-            elif('CONSTANT' in line):
-                constant = float(line.split(' ')[1])
-                grid.set_c(constant)
-            elif('BASIS' in line):
-                basis_bool = bool(int(line.split(' ')[1]))
-                grid.set_basis(basis_bool)
-            elif('SIZE' in line):
-                size = int(line.split(' ')[1])
-                grid.set_N(size)
-            elif('POTENTIAL' in line):
-                pot = float(line.split(' ')[1])
-                grid.set_v(pot)
-            elif('FUNCTION' in line):#no longer needed but keep for posterity
-                func = line.split("'")[1]
-                grid.set_wavefunc(func)
+        for number, line in enumerate(f):
+            words = line.split(None, 1)
+            if(len(words) == 0 or words[0].startswith('#')):
+                continue
+            if(len(words) == 1):
+                raise ValueError("{}, line {}: {} has no value".format(filename, number + 1, words[0]))
+            value = words[1].strip()
+            if(words[0] == 'FUNCTION' and "'" in value):
+                value = value.split("'")[1]
+            settings[words[0]] = value
+    return(settings)
+
+def validate_job(settings, where):
+    '''This checks one job's settings, converts each value to its type from KEYWORDS, and raises a ValueError naming the job if anything is wrong. Integer settings must be whole numbers (int() alone would quietly turn SIZE 10.7 into 10), and FUNCTION must at least compile.'''
+    job = {}
+    for key, value in settings.items():
+        if(key not in KEYWORDS):
+            raise ValueError("{}: unknown keyword {}".format(where, key))
+        try:
+            job[key] = KEYWORDS[key](value)
+            if(KEYWORDS[key] is int and (isinstance(value, bool) or (not isinstance(value, str) and job[key] != value))):
+                raise ValueError
+        except (TypeError, ValueError, OverflowError):
+            raise ValueError("{}: bad value {!r} for {}".format(where, value, key))
+    if('FUNCTION' in job):
+        try:
+            compile(job['FUNCTION'], where, 'eval')
+        except SyntaxError as error:
+            raise ValueError("{}: FUNCTION {!r} is not a valid expression of x ({})".format(where, job['FUNCTION'], error.msg))
+    if('TARGET' not in job):
+        raise ValueError("{}: no TARGET axis file given".format(where))
+    if(job.get('BASIS', 1) not in (0, 1, 2, 3)):
+        raise ValueError("{}: BASIS must be 0, 1, 2 or 3".format(where))
+    if(job.get('ORDER', 2) not in (2, 4, 6)):
+        raise ValueError("{}: ORDER must be 2, 4 or 6".format(where))
+    if(job.get('SIZE', 1) < 1):
+        raise ValueError("{}: SIZE must be positive".format(where))
+    return(job)
+
+def load_axis(target, axes):
+    '''This returns the axis in the file target, reading it only if it isn't in the axes cache yet. The arrays are made read-only, since many Grids share each one.'''
+    if(target not in axes):
+        axis = np.loadtxt(target, usecols = 0, ndmin = 1)#same as read_file: the first number on each line
+        axis.flags.writeable = False
+        axes[target] = axis
+    return(axes[target])
+
+def make_grid(job, axes = None):
+    '''This builds the Grid for one parsed job, taking its axis from the axes cache.'''
+    if(axes is None):
+        axes = {}
+    grid = Grid(load_axis(job['TARGET'], axes))
+    if('CONSTANT' in job):
+        grid.set_c(job['CONSTANT'])
+    if('BASIS' in job):
+        grid.set_basis(job['BASIS'])
+    if('ORDER' in job):
+        grid.set_fd_order(job['ORDER'])
+    if('SIZE' in job):
+        grid.set_N(job['SIZE'])
+    if('POTENTIAL' in job):
+        grid.set_v(job['POTENTIAL'])
+    if('FUNCTION' in job):
+        grid.set_wavefunc(job['FUNCTION'])
+    if(grid.basis == 2):
+        grid.set_N(len(grid.axis))#SIZE doesn't apply, there is one value per grid point
     if(len(grid.wavefunc) == 0):
-        grid.coefficients = np.ones(grid.N)#if no wavefunction is given, do 1.0 for all coeffs
+        grid.coefficients = np.ones(grid.N, dtype = grid.dtype)#if no wavefunction is given, do 1.0 for all coeffs
     return(grid)
-            #still will need to edit this later to also take in a wavefunction
@@ -0,0 +1,238 @@
+'''This writes solver output to disk in shards from a background thread, so the solver never waits on the disk, and reads it back without loading it all.
+
+A results directory holds an index.json plus numbered shards. Each results shard is a handful of .npy files (jobs, energies, nsteps, reasons, and the coefficients of all its results flattened with their offsets), and each trajectory shard holds (job, step, energy) rows. Plain .npy shards can be memory-mapped by ResultsReader; with compress = True they are written as compressed .npz files instead, which are smaller but get read in full. The index is rewritten after every shard, so whatever has been written so far is readable even if the run dies. A writer opened on a directory that already has an index appends to it, so earlier runs are never clobbered unless you ask for overwrite = True.'''
+import json
+import os
+import queue
+import threading
+import numpy as np
+
+
+class ResultsWriter:
+    '''This collects results and trajectory points and writes them out shard_size at a time on a background thread. The queue between them holds at most queue_size items; add only blocks if the disk has fallen that far behind. If the directory already holds results, new shards carry on the numbering after them; with overwrite = True the old shards are deleted and the index starts afresh.'''
+    def __init__(self, directory, shard_size = 1024, queue_size = 64, compress = False, trajectory_batch = 4096, overwrite = False):
+        self.directory = directory
+        self.shard_size = shard_size
+        self.compress = compress
+        self.trajectory_batch = trajectory_batch
+        if(not os.path.isdir(directory)):
+            os.makedirs(directory)
+        self.index = {'format': 1, 'compressed': compress, 'results': [], 'trajectory': []}
+        path = os.path.join(directory, 'index.json')
+        if(os.path.exists(path)):
+            with open(path) as f:
+                existing = json.load(f)
+            if(overwrite):
+                self.remove_shards(existing)
+            elif(existing['compressed'] != compress):
+                raise ValueError("{} holds {} shards, so it can't be appended to with compress = {}".format(directory, 'compressed' if existing['compressed'] else 'plain', compress))
+            else:
+                self.index = existing
+        self.queue = queue.Queue(maxsize = queue_size)
+        self.trajectories = {}#job -> Trajectory still collecting points
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(target = self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add(self, job, result, coefficients):
+        '''This queues one finished job: its id, the VariationResult and the final coefficients (copied, so the grid can carry on). Any trajectory still being collected for the job is flushed first.'''
+        self.check()
+        if(job in self.trajectories):
+            self.trajectories.pop(job).flush()
+        self.queue.put(('result', (job, result.energy.real, result.nsteps, result.reason, np.array(coefficients))))
+
+    def trajectory(self, job):
+        '''This returns a callback for do_variation that records (step, energy) for the job. Points are gathered trajectory_batch at a time in the solver's thread, so the queue sees one item per batch rather than one per step.'''
+        self.trajectories[job] = Trajectory(self, job)
+        return(self.trajectories[job])
+
+    def check(self):
+        '''This re-raises, in the caller's thread, anything that went wrong in the writer thread.'''
+        if(self.error is not None):
+            raise self.error
+        if(self.closed):
+            raise ValueError("ResultsWriter is closed")
+
+    def close(self):
+        '''This flushes everything still pending, writes the last shards and waits for the writer thread to finish.'''
+        if(self.closed):
+            return
+        for trajectory in list(self.trajectories.values()):
+            trajectory.flush()
+        self.trajectories = {}
+        self.queue.put(None)
+        self.thread.join()
+        self.closed = True
+        if(self.error is not None):
+            raise self.error
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *args):
+        self.close()
+
+    def run(self):
+        '''This is the writer thread: it buffers queued items and writes a shard whenever a buffer fills up, and the leftovers when it gets None.'''
+        results = []
+        points = []
+        npoints = 0
+        try:
+            while(True):
+                item = self.queue.get()
+                if(item is None):
+                    break
+                kind, data = item
+                if(kind == 'result'):
+                    results.append(data)
+                    if(len(results) >= self.shard_size):
+                        self.write_results(results)
+                        results = []
+                else:
+                    points.append(data)
+                    npoints += len(data[1])
+                    if(npoints >= self.shard_size * 16):#trajectory rows are much smaller than results
+                        self.write_trajectory(points)
+                        points = []
+                        npoints = 0
+            if(results):
+                self.write_results(results)
+            if(points):
+                self.write_trajectory(points)
+        except Exception as error:
+            self.error = error
+            while(self.queue.get() is not None):#keep draining, so the solver doesn't block on a dead writer
+                pass
+
+    def remove_shards(self, index):
+        '''This deletes the shard files an old index lists, and the index itself.'''
+        for kind in ('results', 'trajectory'):
+            for shard in index[kind]:
+                for filename in os.listdir(self.directory):
+                    if(filename == shard['name'] + '.npz' or filename.startswith(shard['name'] + '.')):
+                        os.remove(os.path.join(self.directory, filename))
+        os.remove(os.path.join(self.directory, 'index.json'))
+
+    def write_shard(self, kind, arrays):
+        '''This writes one shard of named arrays and records it in the index.'''
+        name = '{}_{:05d}'.format(kind, len(self.index[kind]))
+        if(self.compress):
+            np.savez_compressed(os.path.join(self.directory, name + '.npz'), **arrays)
+        else:
+            for key, array in arrays.items():
+                np.save(os.path.join(self.directory, '{}.{}.npy'.format(name, key)), array)
+        self.index[kind].append({'name': name, 'count': len(arrays['jobs'])})
+        path = os.path.join(self.directory, 'index.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.index, f)
+        os.replace(path + '.tmp', path)
+
+    def write_results(self, results):
+        '''This packs a list of (job, energy, nsteps, reason, coefficients) into one results shard.'''
+        coefficients = [result[4] for result in results]
+        offsets = np.cumsum([0] + [len(c) for c in coefficients])
+        self.write_shard('results', {
+            'jobs': np.array([result[0] for result in results], dtype = np.int64),
+            'energies': np.array([result[1] for result in results], dtype = np.float64),
+            'nsteps': np.array([result[2] for result in results], dtype = np.int64),
+            'reasons': np.array([result[3] for result in results], dtype = 'U16'),
+            'offsets': offsets.astype(np.int64),
+            'coefficients': np.concatenate(coefficients).astype(np.result_type(np.float64, *coefficients)),
+        })
+
+    def write_trajectory(self, points):
+        '''This packs a list of (job, steps, energies) batches into one trajectory shard.'''
+        self.write_shard('trajectory', {
+            'jobs': np.concatenate([np.full(len(steps), job, dtype = np.int64) for job, steps, energies in points]),
+            'steps': np.concatenate([steps for job, steps, energies in points]),
+            'energies': np.concatenate([energies for job, steps, energies in points]),
+        })
+
+
+class Trajectory:
+    '''This is the per-step callback ResultsWriter.trajectory hands out. It keeps the latest points in two preallocated arrays and ships them to the writer once they fill up.'''
+    def __init__(self, writer, job):
+        self.writer = writer
+        self.job = job
+        self.steps = np.empty(writer.trajectory_batch, dtype = np.int64)
+        self.energies = np.empty(writer.trajectory_batch, dtype = np.float64)
+        self.count = 0
+
+    def __call__(self, step, energy):
+        self.steps[self.count] = step
+        self.energies[self.count] = energy.real
+        self.count += 1
+        if(self.count == len(self.steps)):
+            self.flush()
+
+    def flush(self):
+        '''This sends whatever points have been gathered to the writer.'''
+        if(self.count > 0):
+            self.writer.check()
+            self.writer.queue.put(('trajectory', (self.job, self.steps[:self.count].copy(), self.energies[:self.count].copy())))
+            self.count = 0
+
+
+class ResultsReader:
+    '''This reads a results directory written by ResultsWriter. Uncompressed shards are memory-mapped (unless mmap = False), so looking up a few results out of millions only touches those few.'''
+    def __init__(self, directory, mmap = True):
+        self.directory = directory
+        with open(os.path.join(directory, 'index.json')) as f:
+            self.index = json.load(f)
+        self.mmap_mode = 'r' if mmap else None
+        self.shards = {}
+        counts = [shard['count'] for shard in self.index['results']]
+        self.starts = np.cumsum([0] + counts)
+
+    def __len__(self):
+        return(int(self.starts[-1]))
+
+    def get_shard(self, kind, number):
+        '''This opens one shard, caching it, and returns a dict of its arrays.'''
+        if((kind, number) not in self.shards):
+            name = self.index[kind][number]['name']
+            if(self.index['compressed']):
+                with np.load(os.path.join(self.directory, name + '.npz')) as data:
+                    self.shards[(kind, number)] = dict((key, data[key]) for key in data.files)
+            else:
+                keys = ('jobs', 'energies', 'nsteps', 'reasons', 'offsets', 'coefficients') if kind == 'results' else ('jobs', 'steps', 'energies')
+                self.shards[(kind, number)] = dict((key, np.load(os.path.join(self.directory, '{}.{}.npy'.format(name, key)), mmap_mode = self.mmap_mode)) for key in keys)
+        return(self.shards[(kind, number)])
+
+    def get_column(self, key):
+        '''This returns one per-result column ('jobs', 'energies', 'nsteps' or 'reasons') for every result, in the order they were written.'''
+        columns = [np.asarray(self.get_shard('results', i)[key]) for i in range(len(self.index['results']))]
+        if(not columns):
+            return(np.zeros(0))
+        return(np.concatenate(columns))
+
+    def get_energies(self):
+        '''This returns every result's energy, in the order they were written.'''
+        return(self.get_column('energies'))
+
+    def __getitem__(self, i):
+        '''This returns the i-th result as a dict with job, energy, nsteps, reason and coefficients. The coefficients are a view into the memory-mapped shard.'''
+        if(i < 0):
+            i += len(self)
+        if(i < 0 or i >= len(self)):
+            raise IndexError("result {} out of range".format(i))
+        number = int(np.searchsorted(self.starts, i, side = 'right')) - 1
+        shard = self.get_shard('results', number)
+        j = i - self.starts[number]
+        return({'job': int(shard['jobs'][j]), 'energy': float(shard['energies'][j]), 'nsteps': int(shard['nsteps'][j]), 'reason': str(shard['reasons'][j]),
+                'coefficients': shard['coefficients'][shard['offsets'][j]:shard['offsets'][j+1]]})
+
+    def get_trajectory(self, job):
+        '''This returns the recorded steps and energies for one job.'''
+        steps = []
+        energies = []
+        for number in range(len(self.index['trajectory'])):
+            shard = self.get_shard('trajectory', number)
+            mask = np.asarray(shard['jobs']) == job
+            steps.append(np.asarray(shard['steps'])[mask])
+            energies.append(np.asarray(shard['energies'])[mask])
+        if(not steps):
+            return(np.zeros(0, dtype = np.int64), np.zeros(0))
+        return(np.concatenate(steps), np.concatenate(energies))
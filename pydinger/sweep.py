@@ -0,0 +1,313 @@
+'''This spreads a sweep of jobs over several worker processes, on one machine or many, with a small TCP work queue.
+
+The coordinator splits the jobs into chunks and hands them out; workers pull a chunk, solve each job with Grid.do_variation, and push back the energies and coefficients as raw binary. Every message is a 4-byte header length, a JSON header, an 8-byte body length and the body. A worker that disconnects, or holds a chunk for longer than the lease, has its chunks put back in the queue, and once the queue is empty idle workers get copies of the oldest chunks still out (the first result back wins). With a manifest directory, finished chunks are saved as they arrive, so a coordinator started again on the same sweep only hands out what is left.
+
+Run "python -m pydinger.sweep coordinator jobs.json" on one machine and "python -m pydinger.sweep worker HOST PORT" on as many as you like.'''
+import hashlib
+import json
+import os
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+from collections import deque
+import numpy as np
+
+from .pydinger import make_grid, parse_jobs, load_axis
+
+
+def send_message(sock, header, body = b''):
+    '''This sends one framed message: the JSON header, then the raw body bytes.'''
+    encoded = json.dumps(header).encode('utf-8')
+    sock.sendall(struct.pack('>I', len(encoded)) + encoded + struct.pack('>Q', len(body)) + body)
+
+def receive_exactly(sock, size):
+    '''This reads exactly size bytes, raising ConnectionError if the other end hangs up first.'''
+    data = bytearray()
+    while(len(data) < size):
+        piece = sock.recv(min(size - len(data), 1 << 20))
+        if(not piece):
+            raise ConnectionError("connection closed")
+        data += piece
+    return(bytes(data))
+
+def receive_message(sock):
+    '''This reads one framed message and returns its header dict and body bytes.'''
+    header_size = struct.unpack('>I', receive_exactly(sock, 4))[0]
+    header = json.loads(receive_exactly(sock, header_size).decode('utf-8'))
+    body_size = struct.unpack('>Q', receive_exactly(sock, 8))[0]
+    return(header, receive_exactly(sock, body_size))
+
+def pack_results(results):
+    '''This packs a chunk's results, a list of (energy, nsteps, reason, coefficients), into a header and a binary body: the energies as float64, the step counts as int64, then every coefficient array back to back.'''
+    coefficients = [np.asarray(result[3]) for result in results]
+    dtype = np.result_type(*coefficients) if coefficients else np.dtype(np.float64)
+    header = {'reasons': [result[2] for result in results], 'sizes': [len(c) for c in coefficients], 'dtype': dtype.str}
+    body = np.array([result[0].real for result in results], dtype = np.float64).tobytes()
+    body += np.array([result[1] for result in results], dtype = np.int64).tobytes()
+    body += b''.join(c.astype(dtype).tobytes() for c in coefficients)
+    return(header, body)
+
+def unpack_results(header, body):
+    '''This undoes pack_results, returning the energies, step counts, reasons and list of coefficient arrays.'''
+    n = len(header['sizes'])
+    energies = np.frombuffer(body, dtype = np.float64, count = n)
+    nsteps = np.frombuffer(body, dtype = np.int64, count = n, offset = 8*n)
+    flat = np.frombuffer(body, dtype = np.dtype(header['dtype']), offset = 16*n)
+    offsets = np.cumsum([0] + header['sizes'])
+    coefficients = [flat[offsets[i]:offsets[i+1]] for i in range(n)]
+    return(energies, nsteps, header['reasons'], coefficients)
+
+
+class CoordinatorHandler(socketserver.BaseRequestHandler):
+    '''This serves one worker connection for as long as it stays open. Whatever the worker still holds when the connection drops goes back in the queue.'''
+    def handle(self):
+        coordinator = self.server.coordinator
+        try:
+            while(True):
+                header, body = receive_message(self.request)
+                if(header['op'] == 'get'):
+                    reply, reply_body = coordinator.assign(self, header.get('have', []))
+                elif(header['op'] == 'result'):
+                    coordinator.finish(self, header['chunk'], header, body)
+                    reply, reply_body = {'op': 'ok'}, b''
+                else:
+                    reply, reply_body = {'op': 'error', 'message': 'unknown op {}'.format(header['op'])}, b''
+                send_message(self.request, reply, reply_body)
+        except (ConnectionError, OSError, ValueError):
+            pass#the worker went away
+        finally:
+            coordinator.release(self)
+
+
+class Coordinator:
+    '''This holds the queue of chunks for a sweep and serves them to workers over TCP. jobs is a list of parsed jobs (see parse_jobs), and variation holds the keyword arguments each worker passes to do_variation.'''
+    def __init__(self, jobs, chunk_size = 16, manifest = None, lease_timeout = 600.0, variation = None, host = '127.0.0.1', port = 0):
+        self.jobs = jobs
+        self.chunk_size = chunk_size
+        self.chunks = [list(range(i, min(i + chunk_size, len(jobs)))) for i in range(0, len(jobs), chunk_size)]
+        self.manifest = manifest
+        self.lease_timeout = lease_timeout
+        self.variation = variation if variation is not None else {'cutoff': 10000, 'rtol': 1e-12}
+        self.axes = {}#target -> axis, each file read once (see load_axis)
+        self.lock = threading.Lock()
+        self.leases = {}#chunk -> {worker: deadline}
+        self.results = {}#chunk -> (header, body), for the chunks finished this session
+        self.done = set()
+        if(manifest is not None):
+            self.load_manifest()
+        self.pending = deque(i for i in range(len(self.chunks)) if i not in self.done)
+        self.finished = threading.Event()
+        if(len(self.done) == len(self.chunks)):
+            self.finished.set()
+        self.server = socketserver.ThreadingTCPServer((host, port), CoordinatorHandler, bind_and_activate = False)
+        self.server.daemon_threads = True
+        self.server.block_on_close = False#don't wait on workers that are still connected
+        self.server.allow_reuse_address = True
+        self.server.server_bind()
+        self.server.server_activate()
+        self.server.coordinator = self
+        self.address = self.server.server_address
+        self.thread = None
+
+    def get_fingerprint(self):
+        '''This is a hash of the jobs, the chunking, the do_variation settings and the contents of every TARGET axis, so a manifest is never resumed with a different sweep, different solver settings or an axis file that has since changed.'''
+        targets = sorted(set(job['TARGET'] for job in self.jobs))
+        axes = [[target, hashlib.sha1(np.ascontiguousarray(load_axis(target, self.axes), dtype = np.float64).tobytes()).hexdigest()] for target in targets]
+        text = json.dumps([self.jobs, self.chunk_size, self.variation, axes], sort_keys = True)
+        return(hashlib.sha1(text.encode('utf-8')).hexdigest())
+
+    def load_manifest(self):
+        '''This picks up the finished chunks listed in the manifest directory, or starts a new manifest there.'''
+        if(not os.path.isdir(self.manifest)):
+            os.makedirs(self.manifest)
+        path = os.path.join(self.manifest, 'manifest.json')
+        if(os.path.exists(path)):
+            with open(path) as f:
+                saved = json.load(f)
+            if(saved['fingerprint'] != self.get_fingerprint()):
+                raise ValueError("{} belongs to a different sweep".format(self.manifest))
+            self.done = set(chunk for chunk in saved['done'] if os.path.exists(self.get_chunk_path(chunk)))
+        self.save_manifest()
+
+    def save_manifest(self):
+        '''This writes the list of finished chunks, atomically so a crash never leaves half a manifest.'''
+        path = os.path.join(self.manifest, 'manifest.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'fingerprint': self.get_fingerprint(), 'njobs': len(self.jobs), 'chunk_size': self.chunk_size, 'done': sorted(self.done)}, f)
+        os.replace(path + '.tmp', path)
+
+    def get_chunk_path(self, chunk):
+        '''This is where a finished chunk's results are kept in the manifest directory.'''
+        return(os.path.join(self.manifest, 'chunk_{:06d}.bin'.format(chunk)))
+
+    def expire_leases(self):
+        '''This drops leases past their deadline, and puts chunks nobody holds any more back in the queue. Call with the lock held.'''
+        now = time.time()
+        for chunk, holders in list(self.leases.items()):
+            for worker, deadline in list(holders.items()):
+                if(deadline < now):
+                    del holders[worker]
+            if(not holders):
+                del self.leases[chunk]
+                if(chunk not in self.done):
+                    self.pending.appendleft(chunk)
+
+    def assign(self, worker, have):
+        '''This picks the next chunk for a worker: from the queue if there is anything in it, otherwise a copy of the oldest chunk other workers are still on. Axes the worker doesn't have yet ride along in the body.'''
+        with self.lock:
+            self.expire_leases()
+            if(self.finished.is_set()):
+                return({'op': 'done'}, b'')
+            chunk = None
+            while(self.pending and chunk is None):
+                chunk = self.pending.popleft()
+                if(chunk in self.done or chunk in self.leases):
+                    chunk = None
+            if(chunk is None):
+                #steal: the chunk whose newest lease is oldest, that this worker isn't already on
+                candidates = [(max(holders.values()), chunk) for chunk, holders in self.leases.items() if worker not in holders]
+                if(not candidates):
+                    return({'op': 'wait', 'delay': 0.05}, b'')
+                chunk = min(candidates)[1]
+            self.leases.setdefault(chunk, {})[worker] = time.time() + self.lease_timeout
+        jobs = [self.jobs[i] for i in self.chunks[chunk]]
+        targets = sorted(set(job['TARGET'] for job in jobs) - set(have))
+        axes = [load_axis(target, self.axes) for target in targets]
+        header = {'op': 'chunk', 'chunk': chunk, 'jobs': jobs, 'variation': self.variation, 'axes': [[target, len(axis)] for target, axis in zip(targets, axes)]}
+        return(header, b''.join(axis.astype(np.float64).tobytes() for axis in axes))
+
+    def finish(self, worker, chunk, header, body):
+        '''This records a chunk's results, unless another copy of it beat this one in.'''
+        with self.lock:
+            self.leases.pop(chunk, None)
+            if(chunk in self.done):
+                return
+            if(self.manifest is not None):
+                with open(self.get_chunk_path(chunk) + '.tmp', 'wb') as f:
+                    encoded = json.dumps(header).encode('utf-8')
+                    f.write(struct.pack('>I', len(encoded)) + encoded + body)
+                os.replace(self.get_chunk_path(chunk) + '.tmp', self.get_chunk_path(chunk))
+            self.results[chunk] = (header, body)
+            self.done.add(chunk)
+            if(self.manifest is not None):
+                self.save_manifest()
+            if(len(self.done) == len(self.chunks)):
+                self.finished.set()
+
+    def release(self, worker):
+        '''This takes back everything a lost worker was holding.'''
+        with self.lock:
+            for chunk, holders in list(self.leases.items()):
+                if(worker in holders):
+                    del holders[worker]
+                    if(not holders):
+                        del self.leases[chunk]
+                        if(chunk not in self.done):
+                            self.pending.appendleft(chunk)
+
+    def start(self):
+        '''This starts serving in a background thread.'''
+        self.thread = threading.Thread(target = self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def wait(self, timeout = None):
+        '''This blocks until every chunk is done (True) or the timeout runs out (False).'''
+        return(self.finished.wait(timeout))
+
+    def shutdown(self):
+        '''This stops serving. Workers that ask for more afterwards just see the connection close.'''
+        if(self.thread is not None):
+            self.server.shutdown()
+            self.thread = None
+        self.server.server_close()
+
+    def run(self, timeout = None):
+        '''This serves until the sweep is done, then stops and returns the results.'''
+        self.start()
+        try:
+            self.wait(timeout)
+        finally:
+            self.shutdown()
+        return(self.get_results())
+
+    def get_chunk_results(self, chunk):
+        '''This returns the unpacked results of one finished chunk, from memory or from the manifest.'''
+        if(chunk in self.results):
+            header, body = self.results[chunk]
+        else:
+            with open(self.get_chunk_path(chunk), 'rb') as f:
+                data = f.read()
+            size = struct.unpack('>I', data[:4])[0]
+            header, body = json.loads(data[4:4 + size].decode('utf-8')), data[4 + size:]
+        return(unpack_results(header, body))
+
+    def get_results(self):
+        '''This returns a list with one (energy, nsteps, reason, coefficients) per job, in job order, and None for the jobs that aren't done.'''
+        results = [None for job in self.jobs]
+        for chunk in sorted(self.done):
+            energies, nsteps, reasons, coefficients = self.get_chunk_results(chunk)
+            for position, job in enumerate(self.chunks[chunk]):
+                results[job] = (float(energies[position]), int(nsteps[position]), reasons[position], coefficients[position])
+        return(results)
+
+
+def solve_job(job, axes, variation):
+    '''This solves one job the way main.py does, and returns (energy, nsteps, reason, coefficients).'''
+    grid = make_grid(job, axes)
+    result = grid.do_variation(**variation)
+    return((result.energy, result.nsteps, result.reason, np.asarray(grid.coefficients)))
+
+def run_worker(host, port, retries = 50):
+    '''This pulls chunks from the coordinator at host:port and solves them until it says the sweep is done (or goes away). Axes sent along with chunks are kept, read-only, for later chunks.'''
+    axes = {}
+    for attempt in range(retries):
+        try:
+            sock = socket.create_connection((host, port))
+            break
+        except OSError:
+            time.sleep(0.1)#the coordinator may still be starting up
+    else:
+        raise ConnectionError("could not reach the coordinator at {}:{}".format(host, port))
+    try:
+        while(True):
+            send_message(sock, {'op': 'get', 'have': sorted(axes)})
+            header, body = receive_message(sock)
+            if(header['op'] == 'done'):
+                break
+            elif(header['op'] == 'wait'):
+                time.sleep(header['delay'])
+                continue
+            offset = 0
+            for target, length in header['axes']:
+                axis = np.frombuffer(body, dtype = np.float64, count = length, offset = offset).copy()
+                axis.flags.writeable = False
+                axes[target] = axis
+                offset += 8*length
+            results = [solve_job(job, axes, header['variation']) for job in header['jobs']]
+            reply, reply_body = pack_results(results)
+            reply.update({'op': 'result', 'chunk': header['chunk']})
+            send_message(sock, reply, reply_body)
+            receive_message(sock)
+    except ConnectionError:
+        pass#the coordinator finished and went away
+    finally:
+        sock.close()
+
+
+if __name__ == '__main__':
+    if(len(sys.argv) >= 3 and sys.argv[1] == 'coordinator'):
+        port = int(sys.argv[3]) if len(sys.argv) > 3 else 5555
+        manifest = sys.argv[4] if len(sys.argv) > 4 else None
+        coordinator = Coordinator(parse_jobs(sys.argv[2]), manifest = manifest, host = '0.0.0.0', port = port)
+        print("Serving {} jobs on port {}".format(len(coordinator.jobs), coordinator.address[1]))
+        for i, result in enumerate(coordinator.run()):
+            print("{} {} {} {}".format(i, result[0], result[1], result[2]))
+    elif(len(sys.argv) == 4 and sys.argv[1] == 'worker'):
+        run_worker(sys.argv[2], int(sys.argv[3]))
+    else:
+        print("usage: python -m pydinger.sweep coordinator JOBFILE [PORT [MANIFEST_DIR]]")
+        print("       python -m pydinger.sweep worker HOST PORT")
@@ -38,6 +38,12 @@ setup(
     },
     include_package_data=True,
     install_requires=requirements,
+    extras_require={
+        'numba': ['numba'],
+        'scipy': ['scipy'],
+        'toml': ['tomli; python_version < "3.11"'],
+    },
+    python_requires='>=3.3',
     license="GNU General Public License v3",
     zip_safe=False,
     keywords='pydinger',
@@ -46,10 +52,8 @@ setup(
         'Intended Audience :: Developers',
         'License :: OSI Approved :: GNU General Public License v3 (GPLv3)',
         'Natural Language :: English',
-        "Programming Language :: Python :: 2",
-        'Programming Language :: Python :: 2.6',
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
         'Programming Language :: Python :: 3.3',
         'Programming Language :: Python :: 3.4',
         'Programming Language :: Python :: 3.5',
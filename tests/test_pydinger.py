@@ -8,16 +8,25 @@ Tests for `pydinger` module.
 """
 
 
-from __future__ import division
 import sys
 import unittest
 from contextlib import contextmanager
 from click.testing import CliRunner
 import numpy as np
 import copy
+import pickle
+import json
+import os
+import tempfile
+import shutil
+import socket
+import multiprocessing
 
 from pydinger import pydinger
 from pydinger import cli
+from pydinger import sweep
+from pydinger import results
+from pydinger import autotune
 
 class TestPydinger(unittest.TestCase):
 
@@ -300,3 +309,643 @@ class TestPydinger(unittest.TestCase):
         grid.do_variation(cutoff = cutoff)
         final_energy = grid.get_energy()
         assert original_energy - final_energy > 0.0001 #should have decreased the energy...
+
+    def test_float32_storage(self):
+        '''This tests the compact float32 storage mode. The coefficients should really be stored in single precision, but the energy is accumulated in float64 and should agree with the double precision energy to well within 1e-5.'''
+        testfile = 'legendre_test_input.txt'
+        grid = pydinger.read_input(testfile)
+        grid.get_coefficients(grid.wavefunc)
+        e64 = grid.get_energy()
+        grid.set_dtype(np.float32)
+        assert grid.axis.dtype == np.float32
+        assert grid.wavefunc.dtype == np.float32
+        assert grid.coefficients.dtype == np.float32
+        e32 = grid.get_energy()
+        assert abs(e32 - e64) < 1e-5 * abs(e64)
+        #the complex Fourier series should drop to complex64
+        grid = pydinger.read_input('fourier_test_input.txt')
+        grid.set_dtype(np.float32)
+        grid.get_coefficients(grid.wavefunc)
+        assert grid.coefficients.dtype == np.complex64
+        #but real Fourier coefficients (no FUNCTION) should stay real
+        grid = pydinger.read_input('fourier_no_function_input.txt')
+        e64 = grid.get_energy()
+        grid.set_dtype(np.float32)
+        assert grid.coefficients.dtype == np.float32
+        e32 = grid.get_energy()
+        assert not np.iscomplexobj(e32)
+        assert abs(e32 - e64) < 1e-5 * abs(e64)
+        assert not np.iscomplexobj(grid.do_variation(100).energy)
+
+    def test_real_fourier(self):
+        '''This tests the packed real sine/cosine Fourier series. It should store real numbers only, reproduce the complex series coefficients, fit the test function about as well, and give the same energy as the complex series with the same modes.'''
+        testfile = 'fourier_test_input.txt'
+        grid = pydinger.read_input(testfile)
+        grid.set_N(21)
+        test_wavefunc = grid.axis**4 - grid.axis**2 + 0.3*np.sin(2*np.pi*grid.axis/grid.period)
+        grid.get_coefficients(test_wavefunc)
+        complex_coeffs = copy.deepcopy(grid.coefficients)
+        grid.set_real_fourier(True)
+        grid.get_coefficients(test_wavefunc)
+        assert grid.coefficients.dtype == np.float64
+        assert len(grid.coefficients) == grid.N
+        assert abs(grid.coefficients[0] - complex_coeffs[0].real) < 0.000001
+        for n in range(1, 11):
+            assert abs(grid.coefficients[2*n-1] - complex_coeffs[n].real) < 0.000001
+            assert abs(grid.coefficients[2*n] + complex_coeffs[n].imag) < 0.000001
+        values = grid.get_values(test_wavefunc)
+        assert ((values - test_wavefunc)**2).sum() < 0.05
+        energy = grid.get_energy()
+        assert isinstance(energy, float)
+        for modes in (6, 11):
+            grid = pydinger.read_input(testfile)
+            grid.set_N(modes)
+            grid.get_coefficients(grid.wavefunc)
+            complex_values = grid.get_values(grid.wavefunc)
+            complex_energy = grid.get_energy()
+            grid.set_real_fourier(True)
+            grid.set_N(2*modes - 1)
+            grid.get_coefficients(grid.wavefunc)
+            assert np.allclose(grid.get_values(grid.wavefunc), complex_values, atol = 1e-12)
+            assert abs(grid.get_energy() - complex_energy) < 1e-10 * abs(complex_energy)
+
+    def test_do_variation_stopping(self):
+        '''This tests the stopping rules of the variational loop. An energy tolerance should stop the run long before the cutoff, a zero time budget should stop after one step, and the result should say why it stopped.'''
+        testfile = 'fourier_no_function_input.txt'
+        grid = pydinger.read_input(testfile)
+        result = grid.do_variation(cutoff = 10000, etol = 1e-10)
+        assert result.reason == 'energy'
+        assert result.converged
+        assert result.nsteps < 10000
+        assert abs(result.energy - grid.get_energy()) < 0.000001
+        grid = pydinger.read_input(testfile)
+        result = grid.do_variation(cutoff = 10000, time_limit = 0.0)
+        assert result.reason == 'time'
+        assert result.nsteps == 1
+        assert not result.converged
+        grid = pydinger.read_input(testfile)
+        result = grid.do_variation(cutoff = 3)
+        assert result.reason == 'cutoff'
+        assert result.nsteps == 3
+
+    def test_operator_cache(self):
+        '''This tests that the dense operator is built once and reused, and rebuilt whenever something it depends on changes.'''
+        grid = pydinger.read_input('legendre_test_input.txt')
+        operator = grid.get_operator()
+        assert grid.get_operator() is operator
+        assert not operator.flags.writeable
+        grid.set_v(grid.v + 1.0)
+        rebuilt = grid.get_operator()
+        assert rebuilt is not operator
+        assert np.allclose(np.diag(rebuilt) - np.diag(operator), grid.period)
+        grid.N = grid.N - 1#even without the setter
+        assert grid.get_operator().shape == (grid.N, grid.N)
+        grid.coefficients = np.ones(grid.N)
+        assert np.allclose(np.dot(grid.get_operator(), grid.coefficients), grid.apply_H())
+
+    def test_do_variation_adaptive(self):
+        '''This tests the adaptive step sizes. With the constant (ground state) Fourier coefficient starting at zero, the fixed 5% steps can never move it, but the adaptive steps should reach the ground state energy v*period.'''
+        testfile = 'fourier_no_function_input.txt'
+        grid = pydinger.read_input(testfile)
+        grid.coefficients[0] = 0.0
+        fixed = grid.do_variation(cutoff = 2000, rtol = 1e-12)
+        assert grid.coefficients[0] == 0.0
+        grid = pydinger.read_input(testfile)
+        grid.coefficients[0] = 0.0
+        adaptive = grid.do_variation(cutoff = 2000, rtol = 1e-12, adaptive = True)
+        assert grid.coefficients[0] != 0.0
+        assert adaptive.nsteps < 2000
+        assert abs(adaptive.energy - grid.v*grid.period) < 0.0001
+        assert adaptive.energy < fixed.energy
+
+    def test_do_variation_complex(self):
+        '''This tests the variation on the complex coefficients a Fourier grid gets from its FUNCTION. The energy should stay real, and both the fixed-step and adaptive loops should find the same ground state as the packed real series.'''
+        grid = pydinger.read_input('fourier_test_input.txt')
+        grid.set_real_fourier(True)
+        grid.get_coefficients(grid.wavefunc)
+        expected = grid.do_variation(cutoff = 3000, rtol = 1e-12, adaptive = True).energy
+        for adaptive in (False, True):
+            grid = pydinger.read_input('fourier_test_input.txt')
+            grid.get_coefficients(grid.wavefunc)
+            assert np.iscomplexobj(grid.coefficients)
+            start = grid.get_energy()
+            assert not np.iscomplexobj(start)
+            result = grid.do_variation(cutoff = 3000, rtol = 1e-12, adaptive = adaptive)
+            assert not np.iscomplexobj(result.energy)
+            assert result.converged
+            assert result.energy < start
+            assert abs(result.energy - expected) < 1e-6 * abs(expected)
+
+    def test_get_changes(self):
+        '''This tests the vectorized probe against the original one-coefficient-at-a-time loop: nudge each coefficient by +-5%, recompute the energy, and put it back. Both the probed energies and the resulting changes vector should match, for both basis sets.'''
+        for testfile in ['legendre_test_input.txt', 'fourier_no_function_input.txt']:
+            grid = pydinger.read_input(testfile)
+            if(len(grid.wavefunc) > 0):
+                grid.get_coefficients(grid.wavefunc)
+            grid.coefficients = grid.coefficients * np.linspace(1.0, -0.5, grid.N)
+            e1 = grid.get_energy()
+            expected = np.zeros(grid.N, dtype = int)
+            e0, e_plus, e_minus = grid.get_probe_energies(0.05 * grid.coefficients)
+            for i in range(grid.N):
+                diff = 0.05 * grid.coefficients[i]
+                grid.coefficients[i] += diff
+                e2 = grid.get_energy()
+                assert abs(e2 - e_plus[i]) < 1e-9 * abs(e2)
+                if(e2 < e1):
+                    expected[i] = 1
+                grid.coefficients[i] -= 2*diff
+                e2 = grid.get_energy()
+                assert abs(e2 - e_minus[i]) < 1e-9 * abs(e2)
+                if(e2 < e1):
+                    expected[i] = -1
+                grid.coefficients[i] += diff
+            original_coeffs = copy.deepcopy(grid.coefficients)
+            changes = grid.get_changes()
+            assert (changes == expected).all()
+            assert (original_coeffs == grid.coefficients).all()
+
+    def test_do_variation_numba(self):
+        '''This tests that the compiled backend runs the same loop as the NumPy one: the same number of steps, the same stopping reason, and the same energy and coefficients. Without numba installed it just falls back to the NumPy loop, so this should pass either way.'''
+        testfile = 'fourier_no_function_input.txt'
+        for adaptive in [False, True]:
+            results = []
+            coefficients = []
+            for backend in ['numpy', 'numba']:
+                grid = pydinger.read_input(testfile)
+                grid.coefficients[0] = 0.0
+                results.append(grid.do_variation(cutoff = 2000, rtol = 1e-12, adaptive = adaptive, backend = backend))
+                coefficients.append(grid.coefficients)
+            assert results[0].nsteps == results[1].nsteps
+            assert results[0].reason == results[1].reason
+            assert abs(results[0].energy - results[1].energy) < 1e-9 * abs(results[0].energy)
+            assert np.allclose(coefficients[0], coefficients[1])
+        #finite differences stay on the banded NumPy loop instead of building an M x M matrix
+        axis = np.linspace(-1.0, 1.0, 20001)
+        results = []
+        for backend in ['numpy', 'numba']:
+            grid = pydinger.Grid(axis)
+            grid.set_basis(2)
+            results.append(grid.do_variation(cutoff = 5, backend = backend))
+        assert results[0].energy == results[1].energy
+        self.assertRaises(ValueError, grid.do_variation_numba)
+
+    def test_get_lowest_states(self):
+        '''This tests the block solver for excited states. The k energies should match the lowest eigenvalues of (the symmetric part of) the Hamiltonian matrix, the states should be orthonormal, and the grid should be left holding the ground state.'''
+        for testfile in ['fourier_no_function_input.txt', 'legendre_test_input.txt']:
+            grid = pydinger.read_input(testfile)
+            grid.set_N(20)
+            energies, states = grid.get_lowest_states(3)
+            assert states.shape == (3, grid.N)
+            operator = grid.get_operator()
+            expected = np.linalg.eigvalsh(0.5*(operator + operator.T))[:3]
+            for i in range(3):
+                assert abs(energies[i] - expected[i]) < 1e-6 * max(1.0, abs(expected[i]))
+            assert np.allclose(np.dot(states, states.T), np.eye(3))
+            assert abs(grid.get_energy() - energies[0]) < 1e-6 * max(1.0, abs(energies[0]))
+
+    def test_propagator(self):
+        '''This tests the split-operator propagator. In imaginary time a harmonic potential 400 x^2 (with c = 1) should relax to its ground state energy of 20, and in real time a displaced Gaussian should keep its norm and energy while it sloshes back and forth. Output should only come every k steps.'''
+        grid = pydinger.read_input('fourier_no_function_input.txt')
+        potential = 400 * grid.axis**2
+        propagator = pydinger.Propagator(grid, 0.001, imaginary = True, potential = potential)
+        outputs = list(propagator.run(2000, every = 500))
+        assert [output[0] for output in outputs] == [500, 1000, 1500, 2000]
+        assert abs(outputs[-1][2]['energy'] - 20.0) < 0.001
+        assert abs(outputs[-1][2]['norm'] - 1.0) < 0.000001
+        propagator = pydinger.Propagator(grid, 0.0001, potential = potential)
+        propagator.psi = np.exp(-10*(grid.axis - 0.2)**2).astype(complex)
+        propagator.normalize()
+        energy = propagator.get_energy()
+        positions = []
+        for step, time, values in propagator.run(1000, every = 100):
+            assert abs(values['norm'] - 1.0) < 0.000001
+            assert abs(values['energy'] - energy) < 0.001 * energy
+            positions.append(values['position'])
+        assert min(positions) < 0.0 < max(positions)#it should have swung through the middle
+
+    def test_read_input_fd(self):
+        '''This tests that "BASIS 2" in an input file picks the finite-difference basis, with one coefficient per grid point and the stencil order from the ORDER keyword.'''
+        grid = pydinger.read_input('fd_test_input.txt')
+        assert grid.basis == 2
+        assert grid.fourier == False
+        assert grid.fd_order == 4
+        assert grid.N == len(grid.axis)
+        assert len(grid.coefficients) == len(grid.axis)
+
+    def test_fd_weights(self):
+        '''This tests the finite-difference stencils on an uneven axis. Away from the ends, a stencil of order p should take the second derivative of x^p exactly, and the banded products should match the dense matrix and its transpose.'''
+        x = np.sin(np.linspace(-1.2, 1.2, 300))
+        u = np.cos(3*x)
+        for order in [2, 4, 6]:
+            bands = pydinger.fd_weights(x, order)
+            p = order//2
+            d2 = pydinger.band_dot(bands, x**order)
+            assert np.allclose(d2[p:-p], order*(order-1)*x[p:-p]**(order-2))
+            dense = pydinger.bands_to_dense(bands)
+            assert np.allclose(pydinger.band_dot(bands, u), np.dot(dense, u))
+            assert np.allclose(pydinger.band_dot(bands, u, transpose = True), np.dot(dense.T, u))
+            block = np.vstack([u, u**2]).T
+            assert np.allclose(pydinger.band_dot(bands, block), np.dot(dense, block))
+
+    def test_fd_ground_state(self):
+        '''This tests the finite-difference basis against the particle in a box. The wavefunction vanishes one spacing past each end of the axis, so with c = 1 the ground state energy is (pi/L)^2 + v, on even and uneven axes alike. Higher order stencils should get closer.'''
+        for x in [np.linspace(-1, 1, 201), np.sin(np.linspace(-1.2, 1.2, 201))]:
+            grid = pydinger.Grid(x)
+            grid.set_basis(2)
+            grid.set_v(2.0)
+            length = x[-1] - x[0] + (x[1] - x[0]) + (x[-1] - x[-2])
+            expected = (np.pi/length)**2 + 2.0
+            errors = []
+            for order in [2, 4, 6]:
+                grid.set_fd_order(order)
+                energies, states = grid.get_lowest_states(1)
+                errors.append(abs(energies[0] - expected))
+            assert errors[0] < 0.001
+            assert errors[2] < errors[0]
+            #the values should look like half a cosine wave
+            values = grid.get_values(None)
+            values = values * np.sign(values[100])
+            assert (values > 0).all()
+        #the block solver only ever goes through the bands, never an M x M matrix
+        dense = pydinger.bands_to_dense
+        pydinger.bands_to_dense = None
+        try:
+            energies, states = grid.get_lowest_states(1)
+        finally:
+            pydinger.bands_to_dense = dense
+        assert abs(energies[0] - expected) < 0.001
+
+    @unittest.skipIf(pydinger.scipy is None, "needs scipy")
+    def test_fd_sparse(self):
+        '''This tests the sparse finite-difference path: the CSR operator should match the dense one, and the sparse eigensolver should find the same lowest states as the block solver.'''
+        grid = pydinger.read_input('fd_test_input.txt')
+        assert np.allclose(grid.get_sparse_operator().toarray(), grid.get_operator())
+        sparse_energies, sparse_states = grid.get_lowest_states_sparse(3)
+        energies, states = grid.get_lowest_states(3)
+        assert np.allclose(sparse_energies, energies)
+        assert abs(grid.get_energy() - energies[0]) < 1e-6
+
+    def test_get_coeffs_chebyshev(self):
+        '''This tests the Chebyshev basis. Given a polynomial that vanishes at both ends of the axis, the DCT and projection should reproduce it to machine precision on the whole axis, and given only the test function's values on the axis it should still fit about as well as the other basis sets.'''
+        grid = pydinger.read_input('legendre_test_input.txt')
+        grid.set_basis(3)
+        assert grid.fourier == False
+        a, b = grid.axis.min(), grid.axis.max()
+        walls = lambda x: (x - a)*(b - x)*(x**2 + 1)
+        grid.get_coefficients(walls)
+        assert len(grid.coefficients) == grid.N
+        values = grid.get_values(None)
+        assert np.abs(values - walls(grid.axis)).max() < 1e-12
+        grid.get_coefficients(grid.wavefunc)
+        values = grid.get_values(grid.wavefunc)
+        assert ((values - grid.wavefunc)**2).sum() < 0.05
+
+    def test_apply_H_chebyshev(self):
+        '''This tests the Chebyshev Hamiltonian. It is a particle in a box with walls at the ends of the axis, so its operator should be symmetric with the exact box energies c pi^2 k^2/L^2 + v as its lowest eigenvalues, and the variation should find the lowest one. apply_H should agree with the dense operator without ever building it, and the O(N) derivative recurrence should agree with numpy's chebder.'''
+        grid = pydinger.read_input('legendre_test_input.txt')
+        grid.set_basis(3)
+        grid.set_N(30)
+        grid.set_c(1.5)
+        grid.set_v(2.0)
+        grid.coefficients = np.random.RandomState(2).standard_normal(grid.N)
+        hc = grid.apply_H()
+        assert grid.operator is None
+        operator = grid.get_operator()
+        assert np.allclose(operator, operator.T)
+        assert np.allclose(np.dot(operator, grid.coefficients), hc)
+        assert np.allclose(grid.get_operator_diagonal(np.arange(grid.N)), np.diag(operator))
+        grid.coefficients = []
+        length = grid.axis.max() - grid.axis.min()
+        expected = [1.5*(np.pi*k/length)**2 + 2.0 for k in (1, 2, 3)]
+        assert np.allclose(np.linalg.eigvalsh(operator)[:3], expected, rtol = 1e-10)
+        result = grid.do_variation(cutoff = 5000, rtol = 1e-14, adaptive = True)
+        assert abs(result.energy - expected[0]) < 1e-4 * expected[0]
+        coefficients = np.random.RandomState(0).standard_normal(grid.N)
+        expected = np.zeros(grid.N)
+        expected[:grid.N-1] = pydinger.C.chebder(coefficients)
+        assert np.allclose(pydinger.chebyshev_derivative(coefficients), expected)
+        grid.coefficients = coefficients
+        assert np.allclose(np.dot(grid.get_operator(), coefficients), grid.apply_H())
+
+    def test_chebyshev_legendre(self):
+        '''This tests the fast Chebyshev-Legendre conversions against evaluating both series, at a size where the low-rank Hankel factors matter, and the O(N) banded solves of the hard-wall mass matrix against the dense Gram matrix of L_(k+2) - L_k.'''
+        n = 300
+        random = np.random.RandomState(3)
+        x = np.linspace(-1, 1, 101)
+        coefficients = random.standard_normal(n)/np.arange(1, n + 1)
+        assert np.allclose(pydinger.C.chebval(x, pydinger.legendre_to_chebyshev(coefficients)), pydinger.L.legval(x, coefficients), atol = 1e-12)
+        assert np.allclose(pydinger.L.legval(x, pydinger.chebyshev_to_legendre(coefficients)), pydinger.C.chebval(x, coefficients), atol = 1e-12)
+        n = 12
+        psi = np.zeros((n, n + 2))
+        psi[np.arange(n), np.arange(n) + 2] = 1.0
+        psi[np.arange(n), np.arange(n)] = -1.0
+        t, weights = pydinger.L.leggauss(n + 2)
+        values = pydinger.L.legvander(t, n + 1).dot(psi.T)
+        mass = np.dot(values.T, weights[:, None]*values)
+        y = random.standard_normal(n)
+        factor = np.linalg.cholesky(mass)
+        assert np.allclose(pydinger.shen_solve(y), np.linalg.solve(factor, y))
+        assert np.allclose(pydinger.shen_solve(y, transpose = True), np.linalg.solve(factor.T, y))
+
+    def test_solution(self):
+        '''This tests the lazily evaluated Solution. It should agree with get_values on the axis, give the right derivatives at points off the axis for each basis set, not depend on the chunk size, and survive pickling.'''
+        grid = pydinger.read_input('legendre_test_input.txt')
+        grid.get_coefficients(grid.wavefunc)
+        solution = grid.get_solution()
+        assert np.allclose(solution(grid.axis), grid.get_values(grid.wavefunc))
+        x = np.random.RandomState(1).uniform(-0.9, 0.9, 1000)
+        assert np.allclose(solution(x, derivative = 2), 12*x**2 - 2)
+        assert np.allclose(solution(x, chunk = 7), solution(x))
+        copied = pickle.loads(pickle.dumps(solution))
+        assert np.allclose(copied(x), x**4 - x**2)
+        grid.set_basis(3)
+        a, b = grid.axis.min(), grid.axis.max()
+        grid.get_coefficients(lambda x: (x - a)*(b - x)*x)
+        solution = grid.get_solution()
+        assert np.allclose(solution(x, derivative = 1), -3*x**2 + 2*(a + b)*x - a*b)
+        assert solution(0.5) == solution(np.array([0.5]))[0]
+        #a periodic function, so the Riemann sum Fourier coefficients are only a few percent off
+        grid = pydinger.read_input('fourier_test_input.txt')
+        grid.set_N(5)
+        theta = 2*np.pi*grid.axis/grid.period
+        test_wavefunc = np.cos(theta) + 0.5*np.sin(2*theta)
+        for real_fourier in [False, True]:
+            grid.set_real_fourier(real_fourier)
+            grid.get_coefficients(test_wavefunc)
+            solution = grid.get_solution()
+            theta = 2*np.pi*x/grid.period
+            assert np.abs(solution(x) - (np.cos(theta) + 0.5*np.sin(2*theta))).max() < 0.05
+            derivative = 2*np.pi/grid.period*(-np.sin(theta) + np.cos(2*theta))
+            assert np.abs(solution(x, derivative = 1) - derivative).max() < 0.1 * np.abs(derivative).max()
+
+    def test_solution_matches_values(self):
+        '''This tests that a Solution evaluated on the axis gives exactly what get_values does, for every basis set, including both forms of the Fourier series, and after the coefficients have been varied.'''
+        for basis, real_fourier in [(0, False), (1, False), (1, True), (2, False), (3, False)]:
+            grid = pydinger.read_input('fourier_test_input.txt')
+            grid.set_basis(basis)
+            grid.set_real_fourier(real_fourier)
+            grid.set_N(20)
+            grid.get_coefficients(grid.wavefunc)
+            for i in range(2):
+                assert np.allclose(grid.get_solution()(grid.axis), grid.get_values(grid.wavefunc), atol = 1e-10)
+                grid.do_variation(cutoff = 50)
+
+    def test_read_jobs(self):
+        '''This tests reading many jobs from one structured input file. Every job should start from the defaults, and they should all share a single read-only copy of the axis.'''
+        grids = pydinger.read_jobs('sweep_test_input.json')
+        assert len(grids) == 3
+        assert [grid.N for grid in grids] == [10, 20, 15]
+        assert [grid.v for grid in grids] == [1.0, 2.0, 3.0]
+        assert [grid.fourier for grid in grids] == [True, True, False]
+        assert grids[0].axis is grids[1].axis
+        assert grids[0].axis is grids[2].axis
+        assert not grids[0].axis.flags.writeable
+        assert len(grids[0].axis) == 200
+        assert np.allclose(grids[1].wavefunc, grids[1].axis**4 - grids[1].axis**2)
+        for item in grids[0].coefficients:
+            assert (item - 1.0) < 0.00001
+        if(pydinger.tomllib is not None):
+            grids = pydinger.read_jobs('sweep_test_input.toml')
+            assert [grid.basis for grid in grids] == [2, 3]
+            assert grids[0].fd_order == 4
+            assert grids[0].N == 200
+            assert grids[1].N == 12
+            assert grids[1].c == 1.5
+
+    def test_parse_jobs_validation(self):
+        '''This tests that bad input gets caught while parsing, before anything is solved, with an error that says which job is wrong.'''
+        bad_jobs = [
+            [{'TARGET': '1D_test.txt', 'SIZ': 10}],
+            [{'SIZE': 10}],
+            [{'TARGET': '1D_test.txt', 'SIZE': 'ten'}],
+            [{'TARGET': '1D_test.txt', 'BASIS': 5}],
+            [{'TARGET': '1D_test.txt', 'SIZE': 10.7, 'BASIS': 1.9}],#int() would quietly make these SIZE 10, BASIS 1
+            [{'TARGET': '1D_test.txt', 'SIZE': '10.7'}],
+            [{'TARGET': '1D_test.txt', 'BASIS': True}],
+            [{'TARGET': '1D_test.txt', 'FUNCTION': 'x**'}],#caught here, not when the grid is built
+            [],
+        ]
+        for jobs in bad_jobs:
+            handle, filename = tempfile.mkstemp(suffix = '.json')
+            with os.fdopen(handle, 'w') as f:
+                json.dump({'jobs': jobs}, f)
+            try:
+                self.assertRaises(ValueError, pydinger.parse_jobs, filename)
+            finally:
+                os.remove(filename)
+        job = pydinger.validate_job({'TARGET': '1D_test.txt', 'SIZE': 10.0, 'ORDER': '4', 'FUNCTION': 'np.exp(-x**2)'}, 'job')
+        assert job['SIZE'] == 10 and isinstance(job['SIZE'], int)
+        assert job['ORDER'] == 4
+
+    def test_sweep(self):
+        '''This tests running a sweep through the coordinator with a few local worker processes. A worker that drops a chunk shouldn't lose it, the results should match solving each job directly, and a coordinator started again on the same manifest should have nothing left to do.'''
+        jobs = [pydinger.validate_job({'TARGET': '1D_test.txt', 'SIZE': size, 'POTENTIAL': potential, 'BASIS': basis}, 'job')
+                for size in (5, 8) for potential in (1.0, 2.0) for basis in (0, 1, 3)]
+        variation = {'cutoff': 2000, 'rtol': 1e-10}
+        manifest = tempfile.mkdtemp()
+        try:
+            coordinator = sweep.Coordinator(jobs, chunk_size = 4, manifest = manifest, variation = variation)
+            coordinator.start()
+            host, port = coordinator.address
+            #a worker that takes a chunk and then disconnects without answering
+            sock = socket.create_connection((host, port))
+            sweep.send_message(sock, {'op': 'get', 'have': []})
+            header, body = sweep.receive_message(sock)
+            assert header['op'] == 'chunk'
+            assert len(body) == 8*200
+            assert header['jobs'] == jobs[:4]#sent as they are, with nothing for the worker to strip
+            assert list(coordinator.axes) == ['1D_test.txt']#read once, through load_axis
+            sock.close()
+            context = multiprocessing.get_context('fork')
+            workers = [context.Process(target = sweep.run_worker, args = (host, port)) for i in range(3)]
+            for worker in workers:
+                worker.start()
+            assert coordinator.wait(120)
+            results = coordinator.get_results()
+            coordinator.shutdown()
+            for worker in workers:
+                worker.join(10)
+            assert len(results) == len(jobs)
+            for job, result in zip(jobs, results):
+                expected = sweep.solve_job(job, {}, variation)
+                assert abs(result[0] - expected[0]) < 1e-10
+                assert result[1] == expected[1]
+                assert result[2] == expected[2]
+                assert np.allclose(result[3], expected[3])
+            resumed = sweep.Coordinator(jobs, chunk_size = 4, manifest = manifest, variation = variation)
+            assert resumed.wait(0)
+            assert len(resumed.pending) == 0
+            for result, expected in zip(resumed.get_results(), results):
+                assert result[0] == expected[0]
+                assert np.array_equal(result[3], expected[3])
+            resumed.shutdown()
+            self.assertRaises(ValueError, sweep.Coordinator, jobs[:5], chunk_size = 4, manifest = manifest)
+            self.assertRaises(ValueError, sweep.Coordinator, jobs, chunk_size = 4, manifest = manifest, variation = dict(variation, rtol = 1e-6))
+            moved = [dict(job, TARGET = os.path.join(manifest, 'axis.txt')) for job in jobs]
+            np.savetxt(moved[0]['TARGET'], np.linspace(-1, 1, 50))
+            sweep.Coordinator(moved, chunk_size = 4, manifest = os.path.join(manifest, 'moved'), variation = variation).shutdown()
+            np.savetxt(moved[0]['TARGET'], np.linspace(-1, 1, 60))#same jobs, but the axis file has changed
+            self.assertRaises(ValueError, sweep.Coordinator, moved, chunk_size = 4, manifest = os.path.join(manifest, 'moved'), variation = variation)
+        finally:
+            shutil.rmtree(manifest)
+
+    def test_do_active_variation(self):
+        '''This tests the active-set variation. Modes that don't matter should get dropped to exactly zero without changing the answer, and a series that looks truncated should grow.'''
+        grid = pydinger.read_file('1D_test.txt')
+        grid.set_N(50)
+        grid.set_v(1.0)
+        grid.set_real_fourier(True)
+        grid.set_wavefunc('np.exp(-x**2)')
+        full = copy.deepcopy(grid)
+        result = grid.do_active_variation(3000, rtol = 1e-13, drop_tol = 1e-6, max_N = 50)
+        assert result.converged
+        assert abs(result.energy - full.do_variation(3000, rtol = 1e-13, adaptive = True).energy) < 1e-9
+        assert len(grid.coefficients) == 50
+        assert len(grid.active) < 10
+        dropped = np.setdiff1d(np.arange(50), grid.active)
+        assert np.all(grid.coefficients[dropped] == 0)
+        grid = pydinger.read_file('1D_test.txt')
+        grid.set_basis(0)
+        grid.set_N(4)
+        grid.set_v(1.0)
+        result = grid.do_active_variation(2000, rtol = 1e-12, max_N = 10)
+        assert 4 < grid.N <= 10
+        assert len(grid.coefficients) == grid.N
+        grid = pydinger.read_file('1D_test.txt')
+        grid.set_basis(2)
+        self.assertRaises(ValueError, grid.do_active_variation)
+
+    def test_do_active_variation_compact(self):
+        '''This tests that the active-set variation handles the complex coefficients of a Fourier FUNCTION, never builds the dense operator for Fourier or Legendre, and keeps exactly the modes whose weight or energy sensitivity is big enough.'''
+        grid = pydinger.read_input('fourier_test_input.txt')
+        grid.get_coefficients(grid.wavefunc)
+        assert np.iscomplexobj(grid.coefficients)
+        result = grid.do_active_variation(3000, rtol = 1e-12, drop_tol = 1e-6)
+        assert result.converged
+        assert abs(result.energy - 3.9798) < 1e-6
+        assert grid.operator is None
+        grid = pydinger.read_file('1D_test.txt')
+        grid.set_basis(0)
+        grid.set_N(6)
+        grid.set_v(1.0)
+        grid.do_active_variation(200, max_N = 12)
+        assert grid.operator is None
+        for basis in (0, 1, 3):
+            grid = pydinger.read_file('1D_test.txt')
+            grid.set_basis(basis)
+            grid.set_N(12)
+            grid.set_v(0.5)
+            rows = np.array([0, 3, 4, 11])
+            columns = np.array([1, 2, 4, 6, 8])
+            assert np.allclose(grid.get_operator_block(rows, columns), grid.get_operator()[np.ix_(rows, columns)])
+            assert np.allclose(grid.get_operator_diagonal(columns), np.diag(grid.get_operator())[columns])
+        grid = pydinger.read_file('1D_test.txt')
+        grid.set_basis(3)
+        grid.set_N(16)
+        grid.set_v(1.0)
+        expected = np.linalg.eigvalsh(grid.get_operator())[0]
+        result = grid.do_active_variation(5000, rtol = 1e-13, drop_tol = 1e-3)
+        assert abs(result.energy - expected) < 1e-4 * expected
+        magnitudes = np.abs(grid.coefficients)
+        assert np.all(magnitudes[grid.active] >= 1e-3 * magnitudes.max())#at the minimum no dropped mode is sensitive enough to come back
+
+    def test_results_writer(self):
+        '''This tests writing results and trajectories through the background writer and reading them back, memory-mapped from plain shards and in full from compressed ones.'''
+        for compress in (False, True):
+            directory = tempfile.mkdtemp()
+            try:
+                expected = []
+                with results.ResultsWriter(directory, shard_size = 2, compress = compress, trajectory_batch = 5) as writer:
+                    for job, size in enumerate((5, 8, 6)):
+                        grid = pydinger.read_file('1D_test.txt')
+                        grid.set_N(size)
+                        grid.set_v(1.0)
+                        grid.set_real_fourier(True)
+                        grid.set_wavefunc('np.exp(-x**2)')
+                        trajectory = []
+                        def record(step, energy):
+                            trajectory.append((step, energy))
+                        callback = writer.trajectory(job)
+                        result = grid.do_variation(200, rtol = 1e-12, callback = lambda step, energy: (record(step, energy), callback(step, energy)))
+                        writer.add(job, result, grid.coefficients)
+                        expected.append((result, np.array(grid.coefficients), trajectory))
+                reader = results.ResultsReader(directory)
+                assert len(reader) == 3
+                assert len(reader.index['results']) == 2
+                assert np.allclose(reader.get_energies(), [item[0].energy for item in expected])
+                for job, (result, coefficients, trajectory) in enumerate(expected):
+                    record = reader[job]
+                    assert record['job'] == job
+                    assert record['nsteps'] == result.nsteps
+                    assert record['reason'] == result.reason
+                    assert np.array_equal(record['coefficients'], coefficients)
+                    assert isinstance(record['coefficients'], np.memmap) != compress
+                    steps, energies = reader.get_trajectory(job)
+                    assert len(trajectory) > 5
+                    assert list(steps) == [step for step, energy in trajectory]
+                    assert np.allclose(energies, [energy for step, energy in trajectory])
+            finally:
+                shutil.rmtree(directory)
+
+    def test_results_writer_existing(self):
+        '''This tests that a second writer on the same directory appends after the first one's shards instead of overwriting them, unless told to overwrite, and won't mix plain and compressed shards.'''
+        directory = tempfile.mkdtemp()
+        try:
+            result = pydinger.VariationResult(1.5, 10, 'rtol', 0.0)
+            for run in range(2):
+                with results.ResultsWriter(directory, shard_size = 2) as writer:
+                    for job in range(3):
+                        writer.add(job, result, np.full(4, run + job))
+            reader = results.ResultsReader(directory)
+            assert len(reader) == 6
+            assert len(reader.index['results']) == 4
+            assert [int(reader[i]['coefficients'][0]) for i in range(6)] == [0, 1, 2, 1, 2, 3]
+            self.assertRaises(ValueError, results.ResultsWriter, directory, compress = True)
+            with results.ResultsWriter(directory, compress = True, overwrite = True) as writer:
+                writer.add(7, result, np.zeros(2))
+            reader = results.ResultsReader(directory)
+            assert len(reader) == 1
+            assert reader[0]['job'] == 7
+            assert sorted(os.listdir(directory)) == ['index.json', 'results_00000.npz']
+        finally:
+            shutil.rmtree(directory)
+
+    def test_autotune(self):
+        '''This tests the autotuner. It should pick the coarsest finite-difference grid that meets the tolerance, the smallest N for a Fourier series that is exact already, own up when a ladder isn't converging, never swap in a basis whose Hamiltonian has a different ground state, and answer from its cache the second time.'''
+        assert np.allclose(autotune.estimate_errors([1.0, 1.5, 1.75, 1.875]), [1.0, 0.5, 0.25, 0.125])
+        assert np.all(np.isinf(autotune.estimate_errors([1.0, 2.0, 4.0, 8.0])))
+        directory = tempfile.mkdtemp()
+        cache = os.path.join(directory, 'cache.json')
+        try:
+            job = {'TARGET': '1D_test.txt', 'POTENTIAL': 1.0, 'BASIS': 2}
+            decision = autotune.autotune(job, tol = 0.05, cache = cache, cutoff = 500)
+            assert decision['met']
+            assert decision['STRIDE'] == 2
+            assert decision['error'] <= 0.05
+            grid = autotune.make_tuned_grid(job, decision)
+            assert grid.N == decision['SIZE'] == 101
+            assert abs(grid.get_lowest_states(1)[0][0] - decision['energy']) < 0.05
+            with open(cache) as f:
+                assert len(json.load(f)) == 1
+            assert decision['solver'] != 'numba'#it would only fall back to NumPy on finite differences
+            assert autotune.autotune(job, tol = 0.05, cache = cache, cutoff = 500) == decision
+            job = {'TARGET': '1D_test.txt', 'POTENTIAL': 1.0}
+            axis = pydinger.load_axis('1D_test.txt', {})
+            assert autotune.get_cache_key(job, axis, 0.05, [8], [1], [1], 500) != autotune.get_cache_key(job, axis, 0.05, [8], [1], [1], 600)
+            decision = autotune.autotune(dict(job, BASIS = 3), bases = [3, 1], cache = None)
+            assert (decision['BASIS'], decision['met']) == (3, True)#Fourier is cheaper, but periodic
+            assert abs(decision['energy'] - (np.pi**2/(axis[-1] - axis[0])**2 + 1.0)) < 1e-6#hard walls at the ends of the axis
+            assert autotune.autotune(job, cache = None)['BASIS'] == 1
+            decision = autotune.autotune({'TARGET': '1D_test.txt', 'POTENTIAL': 1.0}, bases = [0, 1], cache = cache)
+            assert (decision['BASIS'], decision['SIZE'], decision['met']) == (1, 8, True)
+            assert decision['solver'] in ('eigen', 'variation', 'numba')
+            decision = autotune.autotune({'TARGET': '1D_test.txt', 'BASIS': 0}, cache = None)
+            assert not decision['met']
+            assert (decision['SIZE'], decision['STRIDE']) == (64, 1)#the finest rung, since no error estimate can be trusted
+            decision = autotune.autotune({'TARGET': '1D_test.txt', 'POTENTIAL': 1.0, 'BASIS': 2}, tol = 1e-12, strides = (8, 4), cache = None)
+            assert not decision['met']
+            assert decision['STRIDE'] == 4
+            with open(cache) as f:
+                assert len(json.load(f)) == 2
+        finally:
+            shutil.rmtree(directory)
@@ -4,7 +4,6 @@
 """
 
 
-from __future__ import print_function
 import base64
 import json
 import os
@@ -13,12 +12,7 @@ import yaml
 from cryptography.hazmat.primitives.serialization import load_pem_public_key
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.asymmetric.padding import PKCS1v15
-
-
-try:
-    from urllib import urlopen
-except:
-    from urllib.request import urlopen
+from urllib.request import urlopen
 
 
 GITHUB_REPO = 'RainierBarrett/pydinger'